@@ -0,0 +1,114 @@
+#!/usr/bin/env python3.5
+
+import sys
+import os
+import glob
+import gzip
+import time
+import argparse
+import importlib.util
+
+# The anonymizer is a script, so load it from its path
+ANONYMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log-anonymizer.py")
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sampleData", "*")
+
+def LoadAnonymizer():
+    spec = importlib.util.spec_from_file_location("log_anonymizer", ANONYMIZER_PATH)
+    anonymizer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(anonymizer)
+    return anonymizer
+
+def LegacyRecords(anonymizer, lines, type_):
+    # The record assembly of the anonymizer before RecordReader: every
+    # PostgreSQL record is matched twice and continuations are appended to a
+    # string one by one.
+    last_query = None
+    for line in lines:
+        if type_ == "postgresql":
+            m = anonymizer.LOG_REGEX_POSTGRESQL.match(line)
+            if m:
+                if last_query is not None:
+                    n = anonymizer.LOG_REGEX_POSTGRESQL.match(last_query)
+                    if n:
+                        yield list(n.groups())
+                last_query = line
+            else:
+                if anonymizer.POSTGRESQL_PREFIX_REGEX.match(line):
+                    if last_query is not None:
+                        m = anonymizer.LOG_REGEX_POSTGRESQL.match(last_query)
+                        if m:
+                            yield list(m.groups())
+                    last_query = line.strip()
+                else:
+                    if last_query is not None:
+                        last_query += " " + line.strip()
+        else:
+            m = anonymizer.LOG_REGEX.match(line)
+            if m:
+                if last_query is not None:
+                    yield last_query
+                last_query = list(m.groups())
+            else:
+                if last_query is not None:
+                    last_query[-1] += " " + line.strip()
+
+    if last_query is not None:
+        if type_ == "postgresql":
+            m = anonymizer.LOG_REGEX_POSTGRESQL.match(last_query)
+            if m:
+                yield list(m.groups())
+        else:
+            yield last_query
+
+def ReadLines(path):
+    if path.lower().endswith(".gz"):
+        f = gzip.open(path, mode='rt', encoding='utf-8', errors='replace')
+    else:
+        f = open(path, mode='r', encoding='utf-8', errors='replace')
+    with f:
+        return f.readlines()
+
+def Measure(name, records, num_lines, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        num_records = sum(1 for _ in records())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("%-14s %10d lines %10d records %12.0f lines/sec" % (name, num_lines, num_records,
+        num_lines / best if best > 0 else 0))
+    return best
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Benchmark the record assembly of the anonymizer')
+    aparser.add_argument('input', nargs='*', help='Log files to read. Defaults to the sampleData '
+            'directory')
+    aparser.add_argument('--type', default='postgresql', help='relational dbDesktop type')
+    aparser.add_argument('--version', default='5.7', help='MySQL version')
+    aparser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one '
+            'is reported')
+    args = vars(aparser.parse_args())
+
+    anonymizer = LoadAnonymizer()
+    if args['version'] == '5.5':
+        anonymizer.LOG_REGEX = anonymizer.LOG_REGEX_5_5
+
+    # Keep the lines in memory so that only the record assembly is measured
+    lines = []
+    for path in args['input'] or sorted(glob.glob(SAMPLE_DATA)):
+        lines.extend(ReadLines(path))
+    if len(lines) == 0:
+        print("No log lines to read, give log files as input")
+        sys.exit(1)
+
+    type_ = args['type']
+    before = Measure("before", lambda: LegacyRecords(anonymizer, lines, type_), len(lines),
+            args['repeat'])
+    after = Measure("RecordReader", lambda: anonymizer.RecordReader(lines, type_), len(lines),
+            args['repeat'])
+    if after > 0:
+        print("Speedup: %.2fx" % (before / after))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3.5
+
+import sys
+import os
+import glob
+import gzip
+import csv
+import argparse
+import importlib.util
+
+csv.field_size_limit(sys.maxsize)
+
+# The anonymizer is a script, so load it from its path
+ANONYMIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log-anonymizer.py")
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sampleData", "*")
+
+def LoadAnonymizer(salt):
+    spec = importlib.util.spec_from_file_location("log_anonymizer", ANONYMIZER_PATH)
+    anonymizer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(anonymizer)
+    anonymizer.SALT = salt.encode('utf-8')
+    return anonymizer
+
+# Queries where the fast path once disagreed with sqlparse, checked on every
+# run: a placeholder or an operator glued to LIKE is a token of its own
+KNOWN_QUERIES = [
+    "SELECT a FROM t WHERE b LIKE$1'%a'",
+    "SELECT a FROM t WHERE b LIKE $1'%a'",
+    "SELECT a FROM t WHERE b LIKE#1'%a'",
+    "SELECT a FROM t WHERE b LIKE$'%a'",
+    "SELECT a FROM t WHERE b LIKE c$1'%a'",
+]
+
+def CheckQueries(anonymizer, name, queries, max_diff):
+    # Compare the fast path against the sqlparse implementation on every
+    # query
+    checked = 0
+    fast = 0
+    diffs = 0
+    for sql in queries:
+        checked += 1
+        if anonymizer.fast_anonymize(sql) is not None:
+            fast += 1
+        expected = anonymizer.sqlparse_anonymize(sql)
+        result = anonymizer.brutal_anonymize(sql)
+        if result == expected:
+            continue
+
+        diffs += 1
+        if diffs <= max_diff:
+            print("MISMATCH in %s" % name)
+            print("  query:    %r" % sql)
+            print("  sqlparse: %r" % expected)
+            print("  fast:     %r" % result)
+
+    print("%s: %d queries, %d on the fast path, %d mismatches" % (name, checked, fast, diffs))
+    return checked, fast, diffs
+
+def CheckFile(anonymizer, path, max_diff):
+    # Compare the fast path against the sqlparse implementation on every
+    # field of every log record
+    if path.lower().endswith(".gz"):
+        f = gzip.open(path, mode='rt', encoding='utf-8', errors='replace')
+    else:
+        f = open(path, mode='r', encoding='utf-8', errors='replace')
+
+    with f:
+        return CheckQueries(anonymizer, path,
+                (sql for fields in csv.reader(f) for sql in fields), max_diff)
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Compare the fast path of brutal_anonymize '
+            'against the sqlparse implementation')
+    aparser.add_argument('input', nargs='*', help='Log files to check. Defaults to the sampleData '
+            'directory')
+    aparser.add_argument('--salt', default="I fucking hate anonymizing queries", help='Anonymization '
+            'hash salt')
+    aparser.add_argument('--max_diff', type=int, default=10, help='Maximum number of mismatches '
+            'to print per file')
+    args = vars(aparser.parse_args())
+
+    anonymizer = LoadAnonymizer(args['salt'])
+
+    # The known queries alone don't count as a check of the input
+    _, _, known_diffs = CheckQueries(anonymizer, "known queries", KNOWN_QUERIES,
+            args['max_diff'])
+
+    files = args['input'] or sorted(glob.glob(SAMPLE_DATA))
+    total_checked = 0
+    total_fast = 0
+    total_diffs = 0
+    for path in files:
+        checked, fast, diffs = CheckFile(anonymizer, path, args['max_diff'])
+        total_checked += checked
+        total_fast += fast
+        total_diffs += diffs
+
+    print("Total: %d queries, %d on the fast path, %d mismatches" % (total_checked, total_fast,
+        total_diffs))
+    if total_checked == 0:
+        # Nothing was compared, so nothing was shown to match
+        print("No queries to check, give log files with queries as input")
+        sys.exit(1)
+    if total_diffs > 0 or known_diffs > 0:
+        sys.exit(1)
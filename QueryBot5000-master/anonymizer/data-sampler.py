@@ -1,54 +1,231 @@
 #!/usr/bin/env python3.5
 
 import sys
-import glob
 import collections
 import time
 import csv
 import os
-import datetime
 import gzip
 import re
+import random
+import itertools
 import argparse
-from multiprocessing import Process
+from multiprocessing import Pool
 
 csv.field_size_limit(sys.maxsize)
 
 SAMPLE_STEP = 50
 
+SAMPLE_METHODS = ["stride", "bernoulli", "reservoir"]
+
+# The timestamp at the start of an anonymized row up to the minute:
+# "2016-11-30 01:28:19.532 EST" (PostgreSQL), "161130  1:28:19" (MySQL 5.5)
+# or "2016-11-30" "01:28:19.532" in two columns (MySQL 5.7)
+WINDOW_REGEX = re.compile(r"(.*?\d{1,2}:\d{2}):\d{2}")
+TIME_REGEX = re.compile(r"\d{1,2}:\d{2}:\d{2}")
+
 OUTPUT = csv.writer(sys.stdout, quoting=csv.QUOTE_ALL)
 
-def ProcessData(path, num_logs):
-    data = []
-    processed_queries = 0
-    templated_workload = dict()
+def OpenInput(path):
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, mode='rt')
+    return open(path, mode='r')
+
+def OutputPath(path, output_dir):
+    # The name run-sampler.sh always gave the samples, which the file
+    # patterns of the templatizer expect
+    return os.path.join(output_dir, os.path.basename(path) + ".anonymized.sample.gz")
+
+def WindowKey(row):
+    # Returns the minute of the row, or None if it has no timestamp (MySQL
+    # 5.5 only logs the time when it changes)
+    if len(row) == 0:
+        return None
+    stamp = row[0]
+    if len(row) > 1 and TIME_REGEX.match(row[1]):
+        stamp = row[0] + " " + row[1]
+    m = WINDOW_REGEX.match(stamp)
+    if m is None:
+        return None
+    return m.group(1)
+
+def IterWindows(rows):
+    window = None
+    for row in rows:
+        key = WindowKey(row)
+        if key is not None:
+            window = key
+        yield window, row
+
+def Reservoir(items, size, rng):
+    # Algorithm R: a uniform sample of size items in one pass. Returns them
+    # in the order of the input.
+    sample = []
+    for i, item in enumerate(items):
+        if i < size:
+            sample.append((i, item))
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = (i, item)
+    sample.sort(key=lambda x: x[0])
+    return [item for i, item in sample]
+
+def SampleRows(rows, options, rng):
+    method = options['method']
+    if method == "stride":
+        for i, row in enumerate(rows):
+            if i % options['step'] == 0:
+                yield row
+    elif method == "bernoulli":
+        for row in rows:
+            if rng.random() < options['rate']:
+                yield row
+    else:
+        for row in Reservoir(rows, options['size'], rng):
+            yield row
 
-    min_timestamp = datetime.datetime.max
-    max_timestamp = datetime.datetime.min
+def SampleWindows(rows, options, rng, chosen=None):
+    # Keep or drop every row of a minute together, so the arrival rates of
+    # the templates within the kept minutes stay unbiased. The decision is
+    # made when a minute is first seen and remembered, in case the rows of
+    # a minute are not contiguous.
+    method = options['method']
+    keep = dict()
+    for window, row in IterWindows(rows):
+        decision = keep.get(window)
+        if decision is None:
+            if method == "stride":
+                decision = len(keep) % options['step'] == 0
+            elif method == "bernoulli":
+                decision = rng.random() < options['rate']
+            else:
+                decision = window in chosen
+            keep[window] = decision
+        if decision:
+            yield row
 
-    #try:
-    f = gzip.open(path, mode='rt')
-    reader = csv.reader(f, delimiter=',')
-    
-    for i, query_info in enumerate(reader):
-        processed_queries += 1
+def ReadRows(path, num_logs):
+    with OpenInput(path) as f:
+        reader = csv.reader(f, delimiter=',')
+        if num_logs is not None:
+            reader = itertools.islice(reader, num_logs)
+        for query_info in reader:
+            yield query_info
 
-        if (not num_logs is None) and processed_queries > num_logs:
-            break
+def ProcessData(path, num_logs, options, writer):
+    # The random draws only depend on the seed and the name of the file, so
+    # the sample is the same no matter how the files are spread over jobs
+    rng = random.Random("%s:%s" % (options['seed'], os.path.basename(path)))
 
-        if i % SAMPLE_STEP == 0:
-            OUTPUT.writerow(query_info)
+    if options['window']:
+        chosen = None
+        if options['method'] == "reservoir":
+            # A first pass picks the minutes, a second one copies their rows
+            windows = collections.OrderedDict()
+            for window, row in IterWindows(ReadRows(path, num_logs)):
+                windows[window] = True
+            chosen = set(Reservoir(windows.keys(), options['size'], rng))
+        sampled = SampleWindows(ReadRows(path, num_logs), options, rng, chosen)
+    else:
+        sampled = SampleRows(ReadRows(path, num_logs), options, rng)
+
+    kept = 0
+    for query_info in sampled:
+        writer.writerow(query_info)
+        kept += 1
+    return kept
+
+def ProcessFile(task):
+    path, out_path, num_logs, options = task
+    # Only give the output its name once it is complete
+    tmp_path = out_path + ".tmp"
+    with gzip.open(tmp_path, mode='wt', compresslevel=options['compress_level'],
+            newline='') as f:
+        kept = ProcessData(path, num_logs, options, csv.writer(f, quoting=csv.QUOTE_ALL))
+    os.replace(tmp_path, out_path)
+    return path, out_path, kept
+
+def ListInputs(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.append(path)
+    return sorted(files)
+
+def DuplicateNames(files):
+    # The samples are named, and their random draws seeded, by the name of
+    # the input file alone, so two inputs with the same name would share
+    # both
+    paths = collections.defaultdict(list)
+    for path in files:
+        paths[os.path.basename(path)].append(path)
+    return [found for name, found in sorted(paths.items()) if len(found) > 1]
 
 # ==============================================
 # main
 # ==============================================
 if __name__ == '__main__':
-    aparser = argparse.ArgumentParser(description='Templatize SQL Queries')
-    aparser.add_argument('input', help='Input file')
+    aparser = argparse.ArgumentParser(description='Sample anonymized query logs')
+    aparser.add_argument('input', nargs='+', help='Input files or directories')
     aparser.add_argument('--max_log', type=int, help='Maximum number of logs to process in a'
             'data file. Process the whole file if not provided')
+    aparser.add_argument('--method', default="stride", choices=SAMPLE_METHODS,
+            help='Keep every step-th row, every row with probability rate, or a uniform '
+            'sample of size rows')
+    aparser.add_argument('--step', type=int, default=SAMPLE_STEP, help='Stride of the stride '
+            'sampling')
+    aparser.add_argument('--rate', type=float, default=1.0 / SAMPLE_STEP, help='Probability to '
+            'keep a row in the Bernoulli sampling')
+    aparser.add_argument('--size', type=int, default=10000, help='Number of rows kept per file '
+            'by the reservoir sampling')
+    aparser.add_argument('--seed', default="0", help='Seed of the Bernoulli and reservoir '
+            'sampling')
+    aparser.add_argument('--window', action='store_true', help='Sample whole minutes instead of '
+            'single rows, so the per-template arrival rates of the kept minutes stay unbiased')
+    aparser.add_argument('--output_dir', help='Write the sample of every input file gzipped '
+            'to this directory instead of stdout')
+    aparser.add_argument('--compress_level', type=int, default=9, help='gzip level of the '
+            'output files')
+    aparser.add_argument('--jobs', type=int, default=1, help='Number of files to sample in '
+            'parallel')
     args = vars(aparser.parse_args())
 
-    ProcessData(args['input'], args['max_log'])
-    
+    options = {
+        'method': args['method'],
+        'step': args['step'],
+        'rate': args['rate'],
+        'size': args['size'],
+        'seed': args['seed'],
+        'window': args['window'],
+        'compress_level': args['compress_level'],
+    }
+    files = ListInputs(args['input'])
+    duplicates = DuplicateNames(files)
+    if duplicates:
+        aparser.error("input files with the same name: " +
+                "; ".join(", ".join(found) for found in duplicates))
+
+    if args['output_dir'] is None:
+        if len(files) != 1:
+            aparser.error("--output_dir is required to sample more than one file")
+        ProcessData(files[0], args['max_log'], options, OUTPUT)
+        sys.exit(0)
+
+    if not os.path.exists(args['output_dir']):
+        os.makedirs(args['output_dir'])
+
+    # Start with the largest files so that a big one doesn't run alone at
+    # the end
+    files.sort(key=os.path.getsize, reverse=True)
+    tasks = [(path, OutputPath(path, args['output_dir']), args['max_log'], options)
+            for path in files]
 
+    start = time.time()
+    with Pool(args['jobs']) as pool:
+        for path, out_path, kept in pool.imap_unordered(ProcessFile, tasks):
+            print("%s: %d rows -> %s (%.0fs)" % (path, kept, out_path, time.time() - start),
+                    file=sys.stderr)
@@ -10,8 +10,25 @@ import string
 import logging
 import argparse
 import zipfile
+import collections
+import multiprocessing
+import functools
+import os
+import io
+import concurrent.futures
+import tarfile
+import tempfile
+import shutil
+import itertools
+import json
+import time
 
 from pprint import pprint
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 global ANONYMIZE
 
 # ==============================================
@@ -69,6 +86,41 @@ LOG_REGEX_5_5 = re.compile(
 QUERY_REGEX = re.compile(r"(\bSELECT\b|\bselect\b)[\s]+(\S*)[\s]+" +
                          r"(\bFROM\b|\bfrom\b)[\s]+(\S*)[\s]+.*")
 
+# The string literal rules of the sqlparse lexer. The fast path in
+# fast_anonymize uses the very same patterns so that it ends every literal
+# where sqlparse would.
+SINGLE_QUOTE_REGEX = re.compile(r"'(''|\\'|[^'])*'")
+DOUBLE_QUOTE_REGEX = re.compile(r'"(""|\\"|[^"])*"')
+
+# Constructs where sqlparse lexes a quote as part of another token (comments,
+# quoted names, dollar quotes, time zone casts), where it would split the text
+# into several statements, or where a newline token is not whitespace
+FAST_PATH_UNSAFE_REGEX = re.compile(
+    r"--|/\*|# |[`´\[\r;]|\$([_A-ZÀ-Ü]\w*)?\$|\bGO\b|TIME\s+ZONE",
+    re.IGNORECASE | re.UNICODE)
+
+# The reversed trailing word of the text before a literal
+LAST_WORD_REGEX = re.compile(r"[\w$#]+", re.UNICODE)
+
+# Default number of salted hashes kept in memory
+HASH_CACHE_SIZE = 2 ** 17
+
+# Default memory budget (in characters) of the anonymized query cache, and
+# the fraction of it that a single query may take at most
+QUERY_CACHE_SIZE = 64 * 1024 * 1024
+QUERY_CACHE_MAX_ENTRY_FRACTION = 16
+
+# Read buffer size of the input logs
+INPUT_BUFFER_SIZE = 1024 * 1024
+
+# Write buffer size and the size of the blocks compressed by each thread
+# when writing the output ourselves
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_COMPRESS_LEVEL = {
+    "gzip": 6,
+    "zstd": 3,
+}
+
 OUTPUT = csv.writer(sys.stdout, quoting=csv.QUOTE_ALL)
 
 
@@ -77,6 +129,29 @@ OUTPUT = csv.writer(sys.stdout, quoting=csv.QUOTE_ALL)
 # ==============================================
 
 
+def md5_salted(salt, value):
+    """
+    :p salt: the salt key
+    :t salt: bytes
+    :p value: the sensitive data
+    :t value: string
+    returns the hex digest of the salted value
+    """
+    return hashlib.md5(salt + value.encode("utf-8")).hexdigest()
+
+
+# The same literals (ids, names, status strings) show up over and over again
+# in a log, so all the extractors go through a bounded LRU cache in front of
+# md5_salted. See set_hash_cache_size().
+salted_hash = functools.lru_cache(maxsize=HASH_CACHE_SIZE)(md5_salted)
+
+
+def set_hash_cache_size(size):
+    """Replace the hash cache with an empty one holding at most size entries"""
+    global salted_hash
+    salted_hash = functools.lru_cache(maxsize=size)(md5_salted)
+
+
 def is_date_or_digits(inspect):
     """
     :p inspect: the element that we need to inspect
@@ -124,8 +199,7 @@ def iterator_extractor(to_extract, holder, salt):
             holder = holder + " " + val
         else:
             data_length = str(len(val))  # to account for " & "
-            cleaned = hashlib.md5(
-                salt + val.encode("utf-8")).hexdigest()
+            cleaned = salted_hash(salt, val)
             holder = holder + " '" + (data_length + "\\" + str(cleaned)) + "'"
     return holder
 
@@ -147,8 +221,7 @@ def token_extractor(to_extract, holder, salt):
         holder = holder + to_extract
     else:
         data_length = str(len(to_extract) - 2)  # to account for " & "
-        cleaned = hashlib.md5(
-            salt + to_extract.encode("utf-8")).hexdigest()
+        cleaned = salted_hash(salt, to_extract)
         holder = holder + " '" + (data_length + "\\" + str(cleaned)) + "'"
     return holder
 
@@ -197,8 +270,7 @@ def comparison_extractor(to_extract, holder, salt):
         else:
             private = private.strip()  # heh heh
             data_length = str(len(private) - 2)
-            cleaned = hashlib.md5(salt +
-                                  private.encode("utf-8")).hexdigest()
+            cleaned = salted_hash(salt, private)
             holder = holder + " " + notPrivate + " '" + \
                 (data_length + "\\" + str(cleaned)) + "'"
     return holder
@@ -237,7 +309,7 @@ def hash_and_salt(to_clean, flag):
                     holder = holder + elem
                 elif elem.find('%') != -1 or elem.find('_') != -1:
                     holder = (holder + "'" + str(len(elem)) + "\\" +
-                              hashlib.md5(SALT + elem.encode("utf-8")).hexdigest() + "'")
+                              salted_hash(SALT, elem) + "'")
                 else:
                     holder += elem
         # FOR
@@ -311,7 +383,28 @@ def anonymize(sql):
     return clean_sql
 
 
-def brutal_anonymize(sql):
+def anonymize_literal(token_str, last_token):
+    """
+    :p token_str: a quoted string literal of the query
+    :t token_str: string
+    :p last_token: the last non-whitespace token before the literal
+    :t last_token: string
+    returns the literal salted, and pre-pended with the length, unless it is
+    a date, a number, or an incomplete 'LIKE' pattern
+    """
+    if is_date_or_digits(token_str):
+        return token_str
+    # escape anonymization after a 'LIKE' keyword when the string is not complete
+    elif (last_token.upper().find('LIKE') != -1 and
+            (token_str.find('%') != -1 or token_str.find('_') != -1)):
+        return token_str
+    else:
+        data_length = str(len(token_str) - 2)
+        cleaned = salted_hash(SALT, token_str)
+        return " '" + (data_length + "\\" + str(cleaned)) + "'"
+
+
+def sqlparse_anonymize(sql):
     # A brutal version of anonymize(sql)
     # Faltten the sqlparse results, check for all the strings, and then salt
     # the non-dates and non-numerics-only ones.
@@ -334,18 +427,7 @@ def brutal_anonymize(sql):
             and (token_str[0] != '\"' or token_str[-1] != '\"')):
             clean_sql = clean_sql + token_str
         else:
-            if is_date_or_digits(token_str):
-                clean_sql = clean_sql + token_str
-            # escape anonymization after a 'LIKE' keyword when the string is not complete
-            elif (last_token.upper().find('LIKE') != -1 and
-                    (token_str.find('%') != -1 or token_str.find('_') != -1)):
-                clean_sql = clean_sql + token_str
-            else:
-                data_length = str(len(token_str) - 2)
-                cleaned = hashlib.md5(SALT +
-                                      token_str.encode("utf-8")).hexdigest()
-                clean_sql = clean_sql + " '" + \
-                    (data_length + "\\" + str(cleaned)) + "'"
+            clean_sql = clean_sql + anonymize_literal(token_str, last_token)
 
         if token_str not in string.whitespace:
             last_token = token_str
@@ -353,6 +435,119 @@ def brutal_anonymize(sql):
     return clean_sql
 
 
+def fast_anonymize(sql):
+    """
+    :p sql : a SQL query from a sql general log file
+    :t sql : string
+    Same as sqlparse_anonymize(sql), but only scans for the quoted string
+    literals instead of building the sqlparse statement tree
+    returns None if the query has a construct that we leave to sqlparse
+    """
+    if FAST_PATH_UNSAFE_REGEX.search(sql) is not None:
+        return None
+
+    clean_sql = []
+    last_literal = ""
+    pos = 0
+    while True:
+        start = sql.find("'", pos)
+        double = sql.find('"', pos)
+        if start == -1 or (double != -1 and double < start):
+            start = double
+        if start == -1:
+            break
+
+        if sql[start] == "'":
+            m = SINGLE_QUOTE_REGEX.match(sql, start)
+        else:
+            m = DOUBLE_QUOTE_REGEX.match(sql, start)
+        if m is None:
+            # sqlparse turns an unterminated quote into an error token
+            return None
+        token_str = m.group()
+
+        # Find the last non-whitespace token that sqlparse would have seen
+        between = sql[pos:start]
+        stripped = between.rstrip(string.whitespace)
+        if not stripped:
+            last_token = last_literal
+        elif stripped.upper().find('LIKE') == -1:
+            last_token = ""
+        else:
+            word = LAST_WORD_REGEX.match(stripped[::-1])
+            last_token = word.group()[::-1] if word is not None else ""
+            if last_token.find('$') != -1 or last_token.find('#') != -1:
+                # sqlparse may split the word there ('LIKE$1' is 'LIKE',
+                # '$', '1'), so leave it to find the last token
+                return None
+
+        clean_sql.append(between)
+        clean_sql.append(anonymize_literal(token_str, last_token))
+        last_literal = token_str
+        pos = m.end()
+    # WHILE
+    clean_sql.append(sql[pos:])
+
+    return "".join(clean_sql)
+
+
+def brutal_anonymize(sql):
+    # Most queries only need their string literals located, so try the
+    # single-pass scanner before falling back to a full sqlparse parse.
+    clean_sql = fast_anonymize(sql)
+    if clean_sql is None:
+        clean_sql = sqlparse_anonymize(sql)
+    return clean_sql
+
+
+class QueryCache(object):
+    """
+    A bounded LRU cache from the raw query text to its anonymized version,
+    so that queries repeated verbatim (ORM queries with the same parameters,
+    health checks, ...) are only anonymized once. The size of the cache is
+    the total length of the cached queries and results.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def anonymize(self, sql):
+        """returns brutal_anonymize(sql), from the cache if possible"""
+        key = (SALT, sql)
+        clean_sql = self.entries.get(key)
+        if clean_sql is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return clean_sql
+
+        self.misses += 1
+        clean_sql = brutal_anonymize(sql)
+        entry_size = len(sql) + len(clean_sql)
+        # Don't let a single huge query flush the whole cache
+        if entry_size * QUERY_CACHE_MAX_ENTRY_FRACTION >= self.max_bytes:
+            return clean_sql
+
+        self.entries[key] = clean_sql
+        self.size += entry_size
+        while self.size > self.max_bytes:
+            (_, old_sql), old_clean_sql = self.entries.popitem(last=False)
+            self.size -= len(old_sql) + len(old_clean_sql)
+        return clean_sql
+
+
+QUERY_CACHE = QueryCache(QUERY_CACHE_SIZE)
+
+
+def set_query_cache_size(max_bytes):
+    """Replace the query cache with an empty one holding at most max_bytes"""
+    global QUERY_CACHE
+    QUERY_CACHE = QueryCache(max_bytes)
+
+
 def process_query(query, type_):
     global OUTPUT
     """For the given query list, process the SQL string and anonymize it"""
@@ -361,12 +556,12 @@ def process_query(query, type_):
             # remove the double "EST" or "EDT"
             query = query[:1] + query[2:4] + query[5:]
             if ANONYMIZE == True:
-                query[3] = brutal_anonymize(query[3])
+                query[3] = QUERY_CACHE.anonymize(query[3])
                 # HACK
                 for regex in CLEAN_CMDS:
                     query[3] = regex.sub(r"\1 ", query[3])
 
-                query[4] = brutal_anonymize(query[4])
+                query[4] = QUERY_CACHE.anonymize(query[4])
 
             OUTPUT.writerow(query)
             return
@@ -379,7 +574,7 @@ def process_query(query, type_):
             # Depending on the version, the CMD might be the 2nd or the 3rd group
             if (query[3] == "Query" or query[2] == 'Query') and ANONYMIZE == True:
 
-                query[-1] = brutal_anonymize(query[-1])
+                query[-1] = QUERY_CACHE.anonymize(query[-1])
                 # HACK
                 for regex in CLEAN_CMDS:
                     query[-1] = regex.sub(r"\1 ", query[-1])
@@ -390,6 +585,1003 @@ def process_query(query, type_):
 # DEF
 
 
+class RecordReader(object):
+    """
+    Assembles the (possibly multi-line) records of a log in one pass.
+    Iterating over it yields the regex groups of every complete record, and
+    cnt / line tell how far into the input it got: while a record is being
+    handled, cnt is the number of lines before the next record.
+    """
+
+    def __init__(self, lines, type_):
+        """
+        :p lines: the log lines to work through
+        :t lines: iterator
+        :p type_: the relational db type of the log
+        :t type_: string
+        """
+        self.lines = lines
+        self.type_ = type_
+        self.cnt = 0
+        self.line = None
+
+    def __iter__(self):
+        if self.type_ == "postgresql":
+            return self._postgresql_records()
+        return self._mysql_records()
+
+    def _postgresql_records(self):
+        # The match of a record whose first line is complete. Anything
+        # following such a line is beyond the reach of the regex anyway, so
+        # we keep the match instead of matching the record again.
+        match = None
+        # The stripped lines of a record whose query spans multiple lines
+        buffer = None
+        cnt = 0
+        line = None
+
+        try:
+            for cnt, line in enumerate(self.lines):
+                m = LOG_REGEX_POSTGRESQL.match(line)
+                if m is not None or POSTGRESQL_PREFIX_REGEX.match(line):
+                    # The position is only updated per record, not per line
+                    self.cnt, self.line = cnt, line
+                    if match is not None:
+                        yield list(match.groups())
+                    elif buffer is not None:
+                        n = LOG_REGEX_POSTGRESQL.match(" ".join(buffer))
+                        if n is not None:
+                            yield list(n.groups())
+
+                    if m is not None:
+                        match = m
+                        buffer = None
+                    else:
+                        match = None
+                        buffer = [line.strip()]
+                elif buffer is not None:
+                    buffer.append(line.strip())
+            # FOR
+        except:
+            self.cnt, self.line = cnt, line
+            raise
+
+        # Flush the record that was still open when the input ran out
+        self.cnt, self.line = cnt + 1, None
+        if match is not None:
+            yield list(match.groups())
+        elif buffer is not None:
+            n = LOG_REGEX_POSTGRESQL.match(" ".join(buffer))
+            if n is not None:
+                yield list(n.groups())
+
+    def _mysql_records(self):
+        record = None
+        # The query of the record followed by its continuation lines
+        buffer = None
+        cnt = 0
+        line = None
+
+        try:
+            for cnt, line in enumerate(self.lines):
+                m = LOG_REGEX.match(line)
+                if m is not None:
+                    if record is not None:
+                        if buffer is not None:
+                            record[-1] = " ".join(buffer)
+                        # The position is only updated per record, not per line
+                        self.cnt, self.line = cnt, line
+                        yield record
+                    record = list(m.groups())
+                    buffer = None
+                else:
+                    # assert not (line.startswith("2016") or line.startswith("2017"))
+                    if record is not None:
+                        if buffer is None:
+                            buffer = [record[-1]]
+                        buffer.append(line.strip())
+            # FOR
+        except:
+            self.cnt, self.line = cnt, line
+            raise
+
+        # Flush the record that was still open when the input ran out
+        self.cnt, self.line = cnt + 1, None
+        if record is not None:
+            if buffer is not None:
+                record[-1] = " ".join(buffer)
+            yield record
+
+
+def process_lines(lines, type_, last_time=None, on_record=None):
+    """
+    :p lines: the log lines to work through
+    :t lines: iterator
+    :p type_: the relational db type of the log
+    :t type_: string
+    :p last_time: the last timestamp seen before these lines
+    :t last_time: string
+    :p on_record: called with the number of lines before the next record
+                  and the last timestamp after every record
+    :t on_record: function
+    Hand every complete record of the given lines to process_query
+    returns the last timestamp seen in a MySQL record
+    """
+    # Work through them to clean them out just
+    # like Taco Bell running through my intestinal tract...
+    reader = RecordReader(lines, type_)
+
+    try:
+        for query in reader:
+            if type_ != "postgresql":
+                if query[0] is None:
+                    query[0] = last_time
+                else:
+                    last_time = query[0]
+            # Process this mofo
+            process_query(query, type_)
+            if STATS is not None:
+                STATS.records += 1
+            if on_record is not None:
+                on_record(reader.cnt, last_time)
+        # FOR
+    except:
+        LOG.error("Unexpected problem on line %d\n%s" % (reader.cnt, reader.line))
+        raise
+
+    return last_time
+# DEF
+
+
+##########################
+# # Cache statistics     #
+##########################
+
+def cache_stats():
+    """returns the hit and miss counters of the caches in this process"""
+    info = salted_hash.cache_info()
+    return {
+        'hash_hits': info.hits,
+        'hash_misses': info.misses,
+        'query_hits': QUERY_CACHE.hits,
+        'query_misses': QUERY_CACHE.misses,
+    }
+
+
+def sum_stats(all_stats):
+    """returns the counters of several processes added up"""
+    total = collections.Counter()
+    for stats in all_stats:
+        total.update(stats)
+    return dict(total)
+
+
+def report_cache_stats(stats):
+    """Log the cache counters at the end of a run"""
+    for name, prefix in (("Query", "query"), ("Hash", "hash")):
+        hits = stats.get(prefix + '_hits', 0)
+        misses = stats.get(prefix + '_misses', 0)
+        lookups = hits + misses
+        LOG.info("%s cache: %d hits, %d misses (%.1f%% hit rate)" %
+                 (name, hits, misses, 100.0 * hits / lookups if lookups else 0.0))
+
+
+##########################
+# # Run statistics       #
+##########################
+
+# The RunStats of this process, None unless --stats-interval or --stats-json
+# asked for them
+STATS = None
+
+STATS_PHASES = ["regex", "fast_path", "sqlparse", "hashing", "csv"]
+
+
+class RunStats(object):
+    """
+    Counts the records and input bytes of this process and splits its time
+    between the phases of the work. Time spent in a phase nested in another
+    one (hashing inside sqlparse) only counts for the inner phase.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.bytes = 0
+        self.times = collections.Counter()
+        self.stack = []
+        self.mark = time.perf_counter()
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self.stack:
+            self.times[self.stack[-1]] += now - self.mark
+        self.stack.append(phase)
+        self.mark = now
+
+    def leave(self):
+        now = time.perf_counter()
+        self.times[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def timed(self, phase, func):
+        """returns func, with the time of every call counted for the phase"""
+        def timed_func(*args, **kwargs):
+            self.enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.leave()
+        timed_func.untimed = func
+        return timed_func
+
+    def snapshot(self):
+        stats = {'records': self.records, 'bytes': self.bytes}
+        for phase in STATS_PHASES:
+            stats['time_' + phase] = self.times[phase]
+        return stats
+
+
+class TimedRegex(object):
+    """Stands in for a log regex and counts the time of its matches"""
+
+    def __init__(self, regex):
+        self.untimed = regex
+        self.match = STATS.timed("regex", regex.match)
+
+
+class TimedWriter(object):
+    """Stands in for the csv OUTPUT writer and counts the time of its rows"""
+
+    def __init__(self, writer):
+        self.untimed = writer
+        self.writerow = STATS.timed("csv", writer.writerow)
+
+
+class CountingReader(io.RawIOBase):
+    """Counts the (decompressed) bytes read from the input"""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            STATS.bytes += n
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self.raw.close()
+        super().close()
+
+
+def untimed(obj):
+    """returns the function, regex or writer that obj times, or obj itself"""
+    return getattr(obj, 'untimed', obj)
+
+
+def enable_stats():
+    """
+    Start collecting the RunStats of this process. The phases are timed by
+    swapping the functions doing the work for timed ones, so runs without
+    stats don't pay for them. A pool worker forked from a main process with
+    stats inherits its timed functions: they are unwrapped first, so they
+    are only timed once, and into the new RunStats of the worker.
+    """
+    global STATS, LOG_REGEX, LOG_REGEX_POSTGRESQL, POSTGRESQL_PREFIX_REGEX
+    global salted_hash, fast_anonymize, sqlparse_anonymize, OUTPUT
+    STATS = RunStats()
+    LOG_REGEX = TimedRegex(untimed(LOG_REGEX))
+    LOG_REGEX_POSTGRESQL = TimedRegex(untimed(LOG_REGEX_POSTGRESQL))
+    POSTGRESQL_PREFIX_REGEX = TimedRegex(untimed(POSTGRESQL_PREFIX_REGEX))
+    hash_func = untimed(salted_hash)
+    salted_hash = STATS.timed("hashing", hash_func)
+    salted_hash.cache_info = hash_func.cache_info
+    fast_anonymize = STATS.timed("fast_path", untimed(fast_anonymize))
+    sqlparse_anonymize = STATS.timed("sqlparse", untimed(sqlparse_anonymize))
+    OUTPUT = TimedWriter(untimed(OUTPUT))
+
+
+def process_stats():
+    """returns the cache counters and the RunStats of this process"""
+    stats = cache_stats()
+    if STATS is not None:
+        stats.update(STATS.snapshot())
+    return stats
+
+
+def summarize_stats(stats, elapsed, workers):
+    """
+    :p stats: the counters of the run summed over all its processes
+    :t stats: dict
+    :p elapsed: seconds since the start of the run
+    :t elapsed: float
+    returns the summary written to --stats-json. The phase times are summed
+    over all the processes, so with several workers they add up to more than
+    the elapsed time.
+    """
+    summary = {
+        'elapsed': elapsed,
+        'workers': workers,
+        'records': stats.get('records', 0),
+        'bytes': stats.get('bytes', 0),
+        'records_per_sec': stats.get('records', 0) / elapsed if elapsed > 0 else 0.0,
+        'bytes_per_sec': stats.get('bytes', 0) / elapsed if elapsed > 0 else 0.0,
+        'times': dict((phase, stats.get('time_' + phase, 0.0)) for phase in STATS_PHASES),
+    }
+    for prefix in ("query", "hash"):
+        hits = stats.get(prefix + '_hits', 0)
+        misses = stats.get(prefix + '_misses', 0)
+        summary[prefix + '_cache'] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+    return summary
+
+
+class StatsReporter(object):
+    """Periodically logs the throughput of the run"""
+
+    def __init__(self, interval, workers):
+        """
+        :p interval: seconds between two reports, 0 to only keep the summary
+        :t interval: float
+        """
+        self.interval = interval
+        self.workers = workers
+        self.start = time.time()
+        self.last_report = self.start
+
+    def maybe_report(self, stats_func):
+        """
+        :p stats_func: returns the counters of the run so far
+        :t stats_func: function
+        """
+        if self.interval <= 0:
+            return
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.report(stats_func(), now)
+
+    def report(self, stats, now):
+        summary = summarize_stats(stats, now - self.start, self.workers)
+        busy = sum(summary['times'].values())
+        LOG.info("%d records, %.1f MB in %.0fs: %.0f records/sec, %.2f MB/sec" %
+                 (summary['records'], summary['bytes'] / 1024.0 / 1024.0, summary['elapsed'],
+                  summary['records_per_sec'], summary['bytes_per_sec'] / 1024.0 / 1024.0))
+        LOG.info("Time split: %s; cache hit rates: query %.1f%%, hash %.1f%%" % (
+            ", ".join("%s %.1f%%" % (phase, 100.0 * summary['times'][phase] / busy if busy else 0.0)
+                      for phase in STATS_PHASES),
+            100.0 * summary['query_cache']['hit_rate'],
+            100.0 * summary['hash_cache']['hit_rate']))
+        self.last_report = now
+
+    def finish(self, stats, json_path):
+        """Log a last report and write the summary of the run as json"""
+        now = time.time()
+        if self.interval > 0:
+            self.report(stats, now)
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(summarize_stats(stats, now - self.start, self.workers), f,
+                          indent=2, sort_keys=True)
+
+
+##########################
+# # Parallel processing  #
+##########################
+
+class RowCollector(list):
+    """Stands in for the csv OUTPUT writer inside the pool workers"""
+
+    def writerow(self, row):
+        self.append(row)
+
+
+def is_record_start(line, type_):
+    """
+    :p line: a decoded log line
+    :t line: string
+    returns true if the line opens a new record, i.e. it is not the
+    continuation of a multi-line query
+    """
+    if type_ == "postgresql":
+        return POSTGRESQL_PREFIX_REGEX.match(line) is not None
+    return LOG_REGEX.match(line) is not None
+
+
+def iter_chunks(files, type_, chunk_lines):
+    """
+    :p files: the opened input members as returned by iter_members
+    :t files: iterator
+    :p chunk_lines: the minimum number of lines in a chunk
+    :t chunk_lines: int
+    Split the input into chunks of lines that always end right before the
+    start of a record or at the end of a member, so no multi-line query is
+    split between two chunks. Every chunk comes with the member it was cut
+    from and the number of lines of that member before its end.
+    """
+    for member, pos, f in files:
+        chunk = []
+        for line in f:
+            if len(chunk) >= chunk_lines and is_record_start(line, type_):
+                yield chunk, member, pos
+                chunk = []
+            chunk.append(line)
+            pos += 1
+        # FOR
+        if chunk:
+            yield chunk, member, pos
+    # FOR
+
+
+def init_worker(settings):
+    """Copy the settings from the command line into a pool worker"""
+    global SALT, ANONYMIZE, LOG_REGEX
+    SALT = settings['salt']
+    ANONYMIZE = settings['anonymize']
+    LOG_REGEX = settings['log_regex']
+    set_hash_cache_size(settings['hash_cache_size'])
+    set_query_cache_size(settings['query_cache_size'])
+    if settings['stats']:
+        enable_stats()
+
+
+def anonymize_chunk(chunk):
+    """
+    :p chunk: the lines of the chunk and the relational db type
+    :t chunk: tuple
+    returns the anonymized rows, the last timestamp seen in the chunk, and
+    the counters of the worker
+    """
+    global OUTPUT
+    lines, type_ = chunk
+    OUTPUT = RowCollector()
+    last_time = process_lines(lines, type_)
+    return list(OUTPUT), last_time, (os.getpid(), process_stats())
+
+
+def process_parallel(files, type_, workers, chunk_lines, settings, last_time=None,
+                     checkpoint=None, reporter=None):
+    """
+    Anonymize the record-aligned chunks of the input on a pool of worker
+    processes and write the rows out in the original order
+    returns the counters summed over all the workers
+    """
+    # MySQL 5.5 only logs the time when it changes, so the first records of
+    # a chunk take the last timestamp of the chunks before them.
+    pending = collections.deque()
+    # The latest cache counters of every worker process
+    worker_stats = dict()
+
+    def write_rows(task):
+        member, pos, result = task
+        rows, chunk_time, (pid, stats) = result.get()
+        worker_stats[pid] = stats
+        for row in rows:
+            if row[0] is None:
+                row[0] = last_time
+            OUTPUT.writerow(row)
+        chunk_time = chunk_time if chunk_time is not None else last_time
+        if checkpoint is not None:
+            checkpoint.maybe_save(member, pos, chunk_time)
+        if reporter is not None:
+            reporter.maybe_report(lambda: sum_stats(list(worker_stats.values()) +
+                                                    [process_stats()]))
+        return chunk_time
+
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(settings,)) as pool:
+        for chunk, member, pos in iter_chunks(files, type_, chunk_lines):
+            pending.append((member, pos,
+                            pool.apply_async(anonymize_chunk, ((chunk, type_),))))
+            # Bound the number of chunks held in memory
+            if len(pending) >= 2 * workers:
+                last_time = write_rows(pending.popleft())
+        # FOR
+        while pending:
+            last_time = write_rows(pending.popleft())
+
+    return sum_stats(worker_stats.values())
+# DEF
+
+
+class MemberWriter(object):
+    """
+    Stands in for the csv OUTPUT writer when a pool worker anonymizes a whole
+    archive member. The rows go to a spool file, except for the MySQL 5.5
+    rows that precede the first timestamp of the member: those are kept aside
+    so the main process can give them the last timestamp of the members
+    before.
+    """
+
+    def __init__(self, spool_path):
+        self.head = []
+        self.timed = False
+        self.spool = open(spool_path, mode='w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.spool, quoting=csv.QUOTE_ALL)
+
+    def writerow(self, row):
+        if not self.timed and row[0] is None:
+            self.head.append(row)
+            return
+        self.timed = True
+        self.writer.writerow(row)
+
+
+def anonymize_member(task):
+    """
+    :p task: the input path, the member name, the relational db type, the
+             number of lines to skip at the start of the member and the path
+             of the spool file to write
+    :t task: tuple
+    returns the rows before the first timestamp, the last timestamp seen in
+    the member, and the counters of the worker
+    """
+    global OUTPUT
+    path, name, type_, skip, spool_path = task
+    writer = MemberWriter(spool_path)
+    OUTPUT = writer if STATS is None else TimedWriter(writer)
+    try:
+        with open_member(path, name) as f:
+            skip_lines(f, skip)
+            last_time = process_lines(f, type_)
+    finally:
+        writer.spool.close()
+    return writer.head, last_time, (os.getpid(), process_stats())
+
+
+def iter_member_inputs(path, members, first_member, spool_dir):
+    """
+    :p path: the input archive
+    :t path: string
+    Yield the index of every member from the first one on, with the path and
+    the member name a worker opens it by. The members of a zip are opened by
+    name in the workers. A tar can only be read front to back, so the main
+    process streams it once and copies every member to a spool file of the
+    spool directory.
+    """
+    if not is_tar(path):
+        for member in range(first_member, len(members)):
+            yield member, path, members[member]
+        return
+
+    with tarfile.open(path, 'r|*') as tf:
+        member = -1
+        for info in tf:
+            if not info.isfile():
+                continue
+            member += 1
+            if member < first_member:
+                continue
+            spool_path = os.path.join(spool_dir, "%d.log" % member)
+            with open(spool_path, 'wb') as spool:
+                shutil.copyfileobj(tf.extractfile(info), spool, INPUT_BUFFER_SIZE)
+            yield member, spool_path, None
+        # FOR
+
+
+def process_members_parallel(path, members, type_, workers, settings, stream, start=(0, 0),
+                             last_time=None, checkpoint=None, reporter=None):
+    """
+    Anonymize every member of an archive from the start position on a pool
+    of worker processes and copy their output to the stream in the order of
+    the archive
+    returns the counters summed over all the workers
+    """
+    first_member, first_line = start
+    pending = collections.deque()
+    worker_stats = dict()
+
+    def write_member(task):
+        member, input_path, spool_path, result = task
+        head, member_time, (pid, stats) = result.get()
+        worker_stats[pid] = stats
+        for row in head:
+            row[0] = last_time
+            OUTPUT.writerow(row)
+        with open(spool_path, mode='r', encoding='utf-8', newline='') as spool:
+            shutil.copyfileobj(spool, stream, INPUT_BUFFER_SIZE)
+        os.remove(spool_path)
+        if input_path != path:
+            os.remove(input_path)
+        member_time = member_time if member_time is not None else last_time
+        if checkpoint is not None:
+            checkpoint.maybe_save(member + 1, 0, member_time)
+        if reporter is not None:
+            reporter.maybe_report(lambda: sum_stats(list(worker_stats.values()) +
+                                                    [process_stats()]))
+        return member_time
+
+    # The pool is stopped before the spool directory and whatever is left in
+    # it are removed, also when a worker or the main process fails
+    with tempfile.TemporaryDirectory(prefix='anonymizer-') as spool_dir, \
+            multiprocessing.Pool(workers, initializer=init_worker,
+                                 initargs=(settings,)) as pool:
+        for member, input_path, name in iter_member_inputs(path, members, first_member,
+                                                           spool_dir):
+            skip = first_line if member == first_member else 0
+            spool_path = os.path.join(spool_dir, "%d.csv" % member)
+            pending.append((member, input_path, spool_path, pool.apply_async(
+                anonymize_member, ((input_path, name, type_, skip, spool_path),))))
+            if len(pending) >= 2 * workers:
+                last_time = write_member(pending.popleft())
+        # FOR
+        while pending:
+            last_time = write_member(pending.popleft())
+
+    return sum_stats(worker_stats.values())
+# DEF
+
+
+##########################
+# # Input                #
+##########################
+
+def is_tar(path):
+    lower = path.lower()
+    return lower.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"))
+
+
+class StreamReader(io.RawIOBase):
+    """
+    A raw reader over a member of a tar read in stream mode, which can only
+    go front to back and breaks when asked whether it is seekable
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, b):
+        data = self.fileobj.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def text_stream(raw):
+    """returns a buffered utf-8 text decoder over the binary stream"""
+    if STATS is not None:
+        raw = CountingReader(raw)
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=INPUT_BUFFER_SIZE),
+                            encoding='utf-8', errors='replace')
+
+
+def list_members(path):
+    """
+    :p path: the input log, either plain, gzipped, or an archive of logs
+    :t path: string
+    returns the names of the logs in the archive, or [None] if the input is
+    a single log
+    """
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path, 'r') as zf:
+            return [info.filename for info in zf.infolist() if not info.is_dir()]
+    elif is_tar(path):
+        with tarfile.open(path, 'r:*') as tf:
+            return [info.name for info in tf.getmembers() if info.isfile()]
+    return [None]
+
+
+def open_member(path, name):
+    """
+    :p path: the input log
+    :t path: string
+    :p name: a name returned by list_members
+    :t name: string
+    returns a text stream over that one log. The members of a tar are only
+    read in stream mode, by iter_streams.
+    """
+    if path.lower().endswith(".zip"):
+        # The archive file stays open until the member stream is closed
+        with zipfile.ZipFile(path, 'r') as zf:
+            return text_stream(zf.open(name))
+    elif path.lower().endswith(".gz"):
+        return text_stream(gzip.open(path, 'rb'))
+    return text_stream(open(path, 'rb', buffering=0))
+
+
+def skip_lines(f, count):
+    """Read past the first count lines of the text stream"""
+    collections.deque(itertools.islice(f, count), maxlen=0)
+
+
+def iter_members(path, start=(0, 0)):
+    """
+    :p path: the input log
+    :t path: string
+    :p start: the member and the line within it to start from
+    :t start: tuple
+    Stream every log of the input from the start position on, with its index
+    and the number of lines skipped at its start
+    """
+    first_member, first_line = start
+    for member, f in enumerate(iter_streams(path)):
+        if member < first_member:
+            continue
+        skip = first_line if member == first_member else 0
+        skip_lines(f, skip)
+        yield member, skip, f
+    # FOR
+
+
+def iter_streams(path):
+    """
+    :p path: the input log
+    :t path: string
+    Stream every log of the input one after another as text, reading
+    archives front to back only once
+    """
+    if is_tar(path):
+        with tarfile.open(path, 'r|*') as tf:
+            for info in tf:
+                if info.isfile():
+                    with text_stream(StreamReader(tf.extractfile(info))) as f:
+                        yield f
+    elif path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path, 'r') as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with text_stream(zf.open(info)) as f:
+                        yield f
+    else:
+        with open_member(path, None) as f:
+            yield f
+
+
+##########################
+# # Compressed output    #
+##########################
+
+def open_output_file(path, offset=None):
+    """
+    :p path: the output file
+    :t path: string
+    :p offset: where to continue a resumed run, None to start a new file
+    :t offset: int
+    returns the binary output file, cut back to the offset when resuming
+    """
+    if offset is None:
+        return open(path, 'wb')
+    out = open(path, 'r+b')
+    out.truncate(offset)
+    out.seek(offset)
+    return out
+
+
+class PlainWriter(io.RawIOBase):
+    """Writes the output as it is"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.out.write(b)
+
+    def checkpoint(self):
+        """returns the size of the output written so far"""
+        self.out.flush()
+        return self.out.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        self.out.close()
+        super().close()
+
+
+class GzipBlockWriter(io.RawIOBase):
+    """
+    Compresses the output in independent blocks on a pool of threads (zlib
+    releases the GIL) and writes them out in order as concatenated gzip
+    members, which every gzip reader handles as one stream.
+    """
+
+    def __init__(self, out, level, threads):
+        self.out = out
+        self.level = level
+        self.threads = threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.pending = collections.deque()
+        self.block = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.block += b
+        if len(self.block) >= OUTPUT_BUFFER_SIZE:
+            self._submit()
+        return len(b)
+
+    def _submit(self):
+        self.pending.append(self.executor.submit(gzip.compress, bytes(self.block), self.level))
+        self.block = bytearray()
+        # Bound the number of blocks held in memory
+        while len(self.pending) > 2 * self.threads:
+            self.out.write(self.pending.popleft().result())
+
+    def _drain(self):
+        if self.block:
+            self._submit()
+        while self.pending:
+            self.out.write(self.pending.popleft().result())
+
+    def checkpoint(self):
+        """
+        Cut the current block short so the output ends with a complete gzip
+        member
+        returns the size of the output written so far
+        """
+        self._drain()
+        self.out.flush()
+        return self.out.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        self._drain()
+        self.executor.shutdown()
+        self.out.close()
+        super().close()
+
+
+class ZstdFrameWriter(io.RawIOBase):
+    """
+    Compresses the output with zstandard. A checkpoint ends the current
+    frame, and the next write starts a new one.
+    """
+
+    def __init__(self, out, level, threads):
+        self.out = out
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+        self.stream = compressor.stream_writer(out, write_size=OUTPUT_BUFFER_SIZE)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.stream.write(b)
+        return len(b)
+
+    def checkpoint(self):
+        """returns the size of the output written so far"""
+        self.stream.flush(zstandard.FLUSH_FRAME)
+        self.out.flush()
+        return self.out.tell()
+
+    def close(self):
+        if self.closed:
+            return
+        # Closing the stream ends the frame and closes the file
+        self.stream.close()
+        super().close()
+
+
+def open_output(path, level, threads, offset=None):
+    """
+    :p path: where to write the anonymized csv, compressed according to the
+             extension (.gz or .zst)
+    :t path: string
+    :p level: compression level, None for the default of the format
+    :t level: int
+    :p threads: number of compression threads
+    :t threads: int
+    :p offset: where to continue a resumed run, None to start a new file
+    :t offset: int
+    returns a buffered text stream for the csv writer
+    """
+    if path.lower().endswith(".zst"):
+        if zstandard is None:
+            raise Exception("The zstandard module is required to write %s" % path)
+        if level is None:
+            level = DEFAULT_COMPRESS_LEVEL["zstd"]
+        stream = ZstdFrameWriter(open_output_file(path, offset), level, threads)
+    elif path.lower().endswith(".gz"):
+        if level is None:
+            level = DEFAULT_COMPRESS_LEVEL["gzip"]
+        stream = GzipBlockWriter(open_output_file(path, offset), level, threads)
+    else:
+        stream = PlainWriter(open_output_file(path, offset))
+    return io.TextIOWrapper(io.BufferedWriter(stream, buffer_size=OUTPUT_BUFFER_SIZE),
+                            encoding='utf-8', newline='')
+
+
+##########################
+# # Checkpoints          #
+##########################
+
+def load_checkpoint(path, run):
+    """
+    :p path: the checkpoint file
+    :t path: string
+    :p run: what identifies the run (input, type, salt, ...)
+    :t run: dict
+    returns the saved position, or None if there is no checkpoint
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+    for key, value in run.items():
+        if state.get(key) != value:
+            raise Exception("Checkpoint %s was written with a different %s (%r, not %r)" %
+                            (path, key, state.get(key), value))
+    return state
+
+
+class Checkpoint(object):
+    """
+    Periodically records how far the run got, so that --resume can continue
+    it after a crash. A checkpoint is only taken between two records: it
+    holds the position of the next record in the input (member and line) and
+    the size of the output with every record before it.
+    """
+
+    def __init__(self, path, interval, run, output):
+        """
+        :p path: the checkpoint file
+        :t path: string
+        :p interval: seconds between two checkpoints
+        :t interval: float
+        :p run: what identifies the run, checked on resume
+        :t run: dict
+        :p output: the text stream returned by open_output
+        :t output: TextIOWrapper
+        """
+        self.path = path
+        self.interval = interval
+        self.run = run
+        self.output = output
+        self.last_save = time.time()
+
+    def maybe_save(self, member, line, last_time):
+        if time.time() - self.last_save >= self.interval:
+            self.save(member, line, last_time)
+
+    def save(self, member, line, last_time):
+        """
+        :p member: the index of the input member of the next record
+        :t member: int
+        :p line: the line of the next record within that member
+        :t line: int
+        :p last_time: the last MySQL timestamp before the next record
+        :t last_time: string
+        """
+        self.output.flush()
+        state = dict(self.run)
+        state.update({
+            'member': member,
+            'line': line,
+            'last_time': last_time,
+            'output_offset': self.output.buffer.raw.checkpoint(),
+        })
+        # Replace the previous checkpoint in one step, so a crash while
+        # saving leaves the old one intact
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
 # ==============================================
 # main
 # ==============================================
@@ -400,6 +1592,33 @@ if __name__ == '__main__':
     aparser.add_argument('--no-anonymize', default=False, action='store_true', help='Disable anonymization')
     aparser.add_argument('--version', default='5.7', help='MySQL version')
     aparser.add_argument('--type', default='mysql', help='relational dbDesktop type')
+    aparser.add_argument('--workers', type=int, default=1, metavar='N',
+                         help='Number of processes to anonymize a single file with')
+    aparser.add_argument('--chunk-lines', type=int, default=10000, metavar='L',
+                         help='Number of log lines handed to a worker at a time')
+    aparser.add_argument('--hash-cache-size', type=int, default=HASH_CACHE_SIZE, metavar='S',
+                         help='Number of salted hashes to keep in memory')
+    aparser.add_argument('--query-cache-mb', type=int, default=QUERY_CACHE_SIZE // (1024 * 1024),
+                         metavar='M', help='Memory budget of the anonymized query cache, 0 '
+                         'disables it')
+    aparser.add_argument('--output', default=None, metavar='PATH',
+                         help='Write the csv to PATH instead of stdout, compressed if PATH ends '
+                         'with .gz or .zst')
+    aparser.add_argument('--compress-level', type=int, default=None, metavar='C',
+                         help='Compression level of the output file')
+    aparser.add_argument('--compress-threads', type=int, default=1, metavar='T',
+                         help='Number of threads compressing the output file')
+    aparser.add_argument('--checkpoint-interval', type=float, default=60, metavar='SEC',
+                         help='Seconds between two checkpoints of a run with --output, 0 '
+                         'disables them')
+    aparser.add_argument('--resume', default=False, action='store_true',
+                         help='Continue the run that wrote --output from its last checkpoint')
+    aparser.add_argument('--stats-interval', type=float, default=0, metavar='SEC',
+                         help='Log the throughput, the time split between regex matching, '
+                         'sqlparse, hashing and csv writing, and the cache hit rates every SEC '
+                         'seconds')
+    aparser.add_argument('--stats-json', default=None, metavar='PATH',
+                         help='Write a json summary of the throughput of the run to PATH')
     args = vars(aparser.parse_args())
 
     #pprint(args)
@@ -423,84 +1642,96 @@ if __name__ == '__main__':
     #LOG.error("Hash Salt: \"%s\"" % SALT)
     #sys.exit(1)
 
-    files = []
     inputFile = args['input']
-    if args['input'].lower().endswith(".gz"):
-        f = gzip.open(args['input'], mode='rt',
-                      encoding='utf-8', errors='replace')
-        files.append(f)
-    elif args['input'].lower().endswith(".zip"):
-        zf = zipfile.ZipFile(args['input'], 'r')
-        names = zf.namelist()
-        for name in names:
-            f = zf.open(name)
-            files.append(f)
-    else:
-        f = open(args['input'], mode='r', encoding='utf-8', errors='replace')
-        files.append(f)
-    assert len(files) > 0
+    members = list_members(inputFile)
+    assert len(members) > 0
 
-    # Work through them to clean them out just
-    # like Taco Bell running through my intestinal tract...
-    last_query = None
-    last_time = None
-    cnt = 0
-    line = None
     if 'type' in args:
         type_ = args['type']
 
+    set_hash_cache_size(args['hash_cache_size'])
+    set_query_cache_size(args['query_cache_mb'] * 1024 * 1024)
+
+    # The checkpoint lives next to the output and only fits the same run
+    checkpoint_path = args['output'] + ".checkpoint" if args['output'] else None
+    run = {
+        'input': os.path.abspath(inputFile),
+        'type': type_,
+        'version': args['version'],
+        'anonymize': ANONYMIZE,
+        'salt': hashlib.md5(SALT).hexdigest(),
+    }
+    start = (0, 0)
+    last_time = None
+    offset = None
+    if args['resume']:
+        if checkpoint_path is None:
+            raise Exception("--resume requires --output")
+        state = load_checkpoint(checkpoint_path, run)
+        if state is None:
+            LOG.warning("No checkpoint at %s, starting from the beginning" % checkpoint_path)
+        else:
+            start = (state['member'], state['line'])
+            last_time = state['last_time']
+            offset = state['output_offset']
+            LOG.info("Resuming at line %d of member %d, output offset %d" %
+                     (start[1], start[0], offset))
+
+    output = None
+    checkpoint = None
+    if args['output']:
+        output = open_output(args['output'], args['compress_level'], args['compress_threads'],
+                             offset)
+        OUTPUT = csv.writer(output, quoting=csv.QUOTE_ALL)
+        if args['checkpoint_interval'] > 0:
+            checkpoint = Checkpoint(checkpoint_path, args['checkpoint_interval'], run, output)
+
+    reporter = None
+    if args['stats_interval'] > 0 or args['stats_json']:
+        reporter = StatsReporter(args['stats_interval'], args['workers'])
+
+    settings = {
+        'salt': SALT,
+        'anonymize': ANONYMIZE,
+        'log_regex': LOG_REGEX,
+        'hash_cache_size': args['hash_cache_size'],
+        'query_cache_size': args['query_cache_mb'] * 1024 * 1024,
+        'stats': reporter is not None,
+    }
+    if reporter is not None:
+        enable_stats()
     try:
-        for f in files:
-            for line in f:
-                if type_ == "postgresql":
-                    if isinstance(line, bytes):
-                        line = line.decode("utf-8")
-
-                    m = LOG_REGEX_POSTGRESQL.match(line)
-                    if m:
-                        if last_query is not None:
-                            n = LOG_REGEX_POSTGRESQL.match(last_query)
-                            if n:
-                                #print("First", last_query)
-                                process_query(list(n.groups()), type_)
-
-                        last_query = line
-                    else:
-                        if POSTGRESQL_PREFIX_REGEX.match(line):
-                            if last_query is not None:
-                                m = LOG_REGEX_POSTGRESQL.match(last_query)
-                                if m:
-                                    #print("Second", last_query)
-                                    process_query(list(m.groups()), type_)
-                                else:
-                                    last_query = None
-                            else:
-                                last_query = line.strip()
-                        else:
-                            if last_query is not None:
-                                last_query += " " + line.strip()
-                else:
-                    m = LOG_REGEX.match(line)
-                    if m:
-                        if last_query is not None:
-                            if last_query[0] is None:
-                                last_query[0] = last_time
-                            else:
-                                last_time = last_query[0]
-                            # Process this mofo
-                            process_query(last_query, type_)
-                            last_query = None
-                        # IF
-                        last_query = list(m.groups())
-                    else:
-                        # assert not (line.startswith("2016") or line.startswith("2017"))
-                        if last_query is not None:
-                            last_query[-1] += " " + line.strip()
-                # IF
-                cnt += 1
+        if args['workers'] > 1 and len(members) > 1:
+            # Several logs in an archive: hand out whole logs to the workers
+            stats = process_members_parallel(inputFile, members, type_, args['workers'], settings,
+                                             output if output is not None else sys.stdout,
+                                             start, last_time, checkpoint, reporter)
+            stats = sum_stats([stats, process_stats()])
+        elif args['workers'] > 1:
+            stats = process_parallel(iter_members(inputFile, start), type_, args['workers'],
+                                     args['chunk_lines'], settings, last_time, checkpoint,
+                                     reporter)
+            stats = sum_stats([stats, process_stats()])
+        else:
+            def on_record(line, last_time):
+                if checkpoint is not None:
+                    checkpoint.maybe_save(member, skipped + line, last_time)
+                if reporter is not None:
+                    reporter.maybe_report(process_stats)
+            tracked = checkpoint is not None or reporter is not None
+            callback = on_record if tracked else None
+
+            for member, skipped, f in iter_members(inputFile, start):
+                last_time = process_lines(f, type_, last_time, callback)
             # FOR
-        # FOR
-    except:
-        LOG.error("Unexpected problem on line %d\n%s" % (cnt, line))
-        raise
+            stats = process_stats()
+    finally:
+        if output is not None:
+            output.close()
+    # The run is complete, there is nothing left to resume
+    if checkpoint is not None:
+        checkpoint.remove()
+    report_cache_stats(stats)
+    if reporter is not None:
+        reporter.finish(stats, args['stats_json'])
 # MAIN
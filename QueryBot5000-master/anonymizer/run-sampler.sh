@@ -22,23 +22,22 @@ fi
 
 mkdir -p $2
 
+files=""
 for file in `find $1 -type f`
 do
     filename=`basename $file`
     if [[ $filename == *"schema"* ]]; then
         command="cp $file $2/"
-    else
-        if [ -f $2/$filename.anonymized.gz ]; then
-            continue
-        fi
-        command="./data-sampler.py $file | gzip --best > $2/$filename.anonymized.sample.gz"
-    fi
-
-    if [ ! -f "$2/$filename.anonymized.sample.gz" ]; then
         echo $command
-        eval $command &
+        eval $command
+    elif [ ! -f "$2/$filename.anonymized.sample.gz" ]; then
+        files="$files $file"
     fi
 done
 
-wait
-
+# Sample the remaining files in parallel, the largest ones first
+if [ -n "$files" ]; then
+    command="./data-sampler.py $files --output_dir $2 --jobs `nproc`"
+    echo $command
+    eval $command
+fi
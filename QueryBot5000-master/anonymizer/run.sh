@@ -31,7 +31,7 @@ do
         if [ -f $2/$filename.anonymized.gz ]; then
             continue
         fi
-        command="./log-anonymizer.py --type mysql --version 5.5 $file | gzip --best > $2/$filename.anonymized.gz"
+        command="./log-anonymizer.py --type mysql --version 5.5 --output $2/$filename.anonymized.gz --compress-level 9 $file"
     fi
 
     if [ ! -f "$2/$filename.anonymized.gz" ]; then
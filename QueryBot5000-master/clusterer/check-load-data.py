@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import shutil
+import datetime
+import tempfile
+import argparse
+import importlib.util
+
+# The template store and registry shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from timestamp_parser import EPOCH
+from template_store import TEMPLATE_STORE_SUFFIX, TemplateStoreWriter
+from template_registry import TemplateId
+
+# The scripts whose LoadData must give the same data from csv files and from
+# template stores
+SCRIPTS = ["online_clustering.py", "generate-cluster-coverage.py"]
+
+MINUTE = datetime.timedelta(minutes=1)
+
+# Two days of templatizer output, with a template in both days and a minute
+# in both of them
+SAMPLE_DAYS = {
+    "dbp4_postgresql-2016-11-29.zip.anonymized": {
+        "SELECT a FROM t WHERE b = #": [("2016-11-29 23:58:00", 2), ("2016-11-29 23:59:00", 3)],
+        "SELECT 1": [("2016-11-29 21:13:00", 1)],
+    },
+    "dbp4_postgresql-2016-11-30.zip.anonymized": {
+        "SELECT a FROM t WHERE b = #": [("2016-11-29 23:59:00", 4), ("2016-11-30 00:01:00", 5)],
+        "UPDATE t SET b = # WHERE a = #": [("2016-11-30 08:00:00", 7)],
+    },
+}
+
+def LoadScript(name):
+    # The scripts have no package, so load them from their path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(name)[0].replace('-', '_'),
+            path)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+def WriteSample(csv_dir, store_dir):
+    # Writes the sample days as the templatizer does, as directories of
+    # templateN.csv files and as template stores
+    for day, templates in SAMPLE_DAYS.items():
+        os.makedirs(os.path.join(csv_dir, day))
+        writer = TemplateStoreWriter(os.path.join(store_dir, day + TEMPLATE_STORE_SUFFIX))
+        for template, series in sorted(templates.items()):
+            template_id = TemplateId(template)
+            with open(os.path.join(csv_dir, day, "template%d.csv" % template_id), 'w') as f:
+                csv_writer = csv.writer(f)
+                csv_writer.writerow([sum(count for _, count in series), template])
+                csv_writer.writerows(series)
+            minutes = [(datetime.datetime.strptime(time_stamp, "%Y-%m-%d %H:%M:%S") - EPOCH) //
+                    MINUTE for time_stamp, _ in series]
+            writer.Add(template_id, template, minutes, [count for _, count in series])
+        writer.Close()
+
+def CheckScript(name, csv_dir, store_dir):
+    script = LoadScript(name)
+    from_csv = script.LoadData(csv_dir)
+    from_store = script.LoadData(store_dir)
+    if from_csv == from_store:
+        print("%s: LoadData is the same for %d templates" % (name, len(from_csv[-1])))
+        return True
+
+    print("MISMATCH in %s" % name)
+    # min_date, max_date, data, ..., total_queries, templates
+    for i, (csv_value, store_value) in enumerate(zip(from_csv, from_store)):
+        if csv_value != store_value:
+            print("  value %d:" % i)
+            print("    csv:   %.300r" % (csv_value,))
+            print("    store: %.300r" % (store_value,))
+    return False
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Check that the clusterers load the same data '
+            'from templatizer csv files and from template stores')
+    aparser.add_argument('--csv_dir', help='Templatizer output with csv files. A small sample is '
+            'written if not provided')
+    aparser.add_argument('--store_dir', help='Templatizer output of the same logs with template '
+            'stores')
+    args = vars(aparser.parse_args())
+
+    sample_dir = None
+    csv_dir, store_dir = args['csv_dir'], args['store_dir']
+    if csv_dir is None or store_dir is None:
+        sample_dir = tempfile.mkdtemp()
+        csv_dir = os.path.join(sample_dir, "csv")
+        store_dir = os.path.join(sample_dir, "store")
+        WriteSample(csv_dir, store_dir)
+
+    try:
+        results = [CheckScript(name, csv_dir, store_dir) for name in SCRIPTS]
+    finally:
+        if sample_dir is not None:
+            shutil.rmtree(sample_dir)
+
+    if not all(results):
+        sys.exit(1)
@@ -24,6 +24,12 @@ from sortedcontainers import SortedDict
 from sklearn.preprocessing import normalize
 from sklearn.neighbors import NearestNeighbors
 
+# The timestamp parser shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from timestamp_parser import GetMinuteParser
+from template_store import TEMPLATE_STORE_SUFFIX, ReadTemplateStore
+from template_registry import TemplateFileId
+
 csv.field_size_limit(sys.maxsize)
 
 
@@ -42,18 +48,49 @@ STATEMENTS = ['select', 'SELECT', 'INSERT', 'insert', 'UPDATE', 'update', 'delet
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S" # Strip milliseconds ".%f"
 
 def LoadData(input_path):
+    # The templates are keyed by their IDs, their text isn't needed here.
+    # The series of a template in several days (directories of csv files or
+    # template stores) are added up, so the data is the same for both
+    # formats and whatever the order of the days.
     #print("enter load data")
     total_queries = dict()
     templates = []
     min_date = datetime.max
     max_date = datetime.min
     data = dict()
+    parse_minute = GetMinuteParser(DATETIME_FORMAT).Parse
+
+    def AddSeries(template_id, total, time_stamps, counts):
+        nonlocal min_date, max_date
+        if template_id not in data:
+            templates.append(template_id)
+            total_queries[template_id] = 0
+            data[template_id] = SortedDict()
+        total_queries[template_id] += total
+        series = data[template_id]
+        for time_stamp, count in zip(time_stamps, counts):
+            series[time_stamp] = series.get(time_stamp, 0) + count
+        if len(time_stamps) > 0:
+            min_date = min(min_date, min(time_stamps))
+            max_date = max(max_date, max(time_stamps))
 
     cnt = 0
     for root, dirs, files in os.walk(input_path):
+        # A template store holds what the csv files of a directory would
+        for store_file in sorted(files):
+            if not store_file.endswith(TEMPLATE_STORE_SUFFIX):
+                continue
+
+            print(store_file)
+
+            for template_id, _, time_stamps, counts in ReadTemplateStore(os.path.join(root,
+                    store_file)):
+                AddSeries(template_id, sum(counts), time_stamps, counts)
+
         if root.endswith('.zip.anonymized'):
             for csv_file in sorted(files):
-                if not csv_file.endswith('.csv'):
+                template_id = TemplateFileId(csv_file)
+                if template_id is None:
                     #print(f"Ignoring non-CSV file: {csv_file}")
                     continue
 
@@ -69,37 +106,22 @@ def LoadData(input_path):
                         reader = csv.reader(f)
                         #reader = csv.reader(f, delimiter='\t')  # if data tab-delimited
 
-                        # Skip the first row - column labels
-                        next(reader, None)
-
+                        # The first row is the number of queries and the template
                         queries, template = next(reader)
-                        # To make the matplotlib work...
-                        template = template.replace('$', '')
 
                         # Assume we already filtered out other types of queries when combining template csvs
                         #statement = template.split(' ',1)[0]
                         #if not statement in STATEMENTS:
                         #    continue
 
-                        #print queries, template
-                        queries_datetime = datetime.strptime(queries, "%Y-%m-%d %H:%M:%S")
-                        total_queries[template] = int(queries_datetime.timestamp())
-
-                        #print queries
-                        templates.append(template)
-
-                        # add template
-                        data[template] = SortedDict()
-
                         #Iterate through every line in the CSV file
+                        time_stamps = []
+                        counts = []
                         for line in reader:
-                            time_stamp = datetime.strptime(line[0], DATETIME_FORMAT)
-                            count = int(line[1])
-
-                            data[template][time_stamp] = count
+                            time_stamps.append(parse_minute(line[0]))
+                            counts.append(int(line[1]))
 
-                            min_date = min(min_date, time_stamp)
-                            max_date = max(max_date, time_stamp)
+                        AddSeries(template_id, int(queries), time_stamps, counts)
                 except StopIteration:
                     print(f"StopIteration encountered in file {csv_file}. Moving onto next file")
                     continue
@@ -27,6 +27,12 @@ from sklearn.neighbors import NearestNeighbors
 from logical_clustering_utility.schemaParser import extract_tables_and_columns
 from logical_clustering_utility.buildVectors import create_vectors
 
+# The timestamp parser shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from timestamp_parser import GetMinuteParser
+from template_store import TEMPLATE_STORE_SUFFIX, ReadTemplateStore
+from template_registry import TemplateFileId
+
 csv.field_size_limit(sys.maxsize)
 
 
@@ -44,15 +50,34 @@ USE_KNN = True
 KNN_ALG = "kd_tree"
 
 def LoadData(input_path):
+    # The templates are keyed by their IDs. Their text is only returned to
+    # build their logical vectors.
     total_queries = dict()
-    templates = []
+    templates = dict()
     min_date = datetime.max
     max_date = datetime.min
     data = dict()
+    parse_minute = GetMinuteParser(DATETIME_FORMAT).Parse
 
     cnt = 0
     for csv_file in sorted(os.listdir(input_path)):
         print(csv_file)
+        if csv_file.endswith(TEMPLATE_STORE_SUFFIX):
+            # A template store holds what a directory of csv files would
+            for template_id, template, time_stamps, counts in ReadTemplateStore(input_path +
+                    "/" + csv_file):
+                # To make the matplotlib work...
+                template = template.replace('$', '')
+
+                total_queries[template_id] = sum(counts)
+                templates[template_id] = template
+                data[template_id] = SortedDict(zip(time_stamps, counts))
+
+                min_date = min(min_date, time_stamps[0])
+                max_date = max(max_date, time_stamps[-1])
+            continue
+
+        template_id = TemplateFileId(csv_file)
         with open(input_path + "/" + csv_file, 'r') as f:
             reader = csv.reader(f)
             queries, template = next(reader)
@@ -66,19 +91,19 @@ def LoadData(input_path):
             #    continue
 
             #print queries, template
-            total_queries[template] = int(queries)
+            total_queries[template_id] = int(queries)
             #print queries
 
-            templates.append(template)
+            templates[template_id] = template
 
             # add template
-            data[template] = SortedDict()
+            data[template_id] = SortedDict()
 
             for line in reader:
-                time_stamp = datetime.strptime(line[0], DATETIME_FORMAT)
+                time_stamp = parse_minute(line[0])
                 count = int(line[1])
 
-                data[template][time_stamp] = count
+                data[template_id][time_stamp] = count
 
                 min_date = min(min_date, time_stamp)
                 max_date = max(max_date, time_stamp)
@@ -89,8 +114,6 @@ def LoadData(input_path):
             if cnt == 10:
                 break
 
-    templates = sorted(templates)
-
     return min_date, max_date, data, total_queries, templates
 
 def Similarity(x, y):
@@ -289,8 +312,9 @@ if __name__ == '__main__':
     schema_file = open(args['schema_path'], 'r')
     schema_dict = extract_tables_and_columns(schema_file)
 
-    # Get logical vectors for query templates
-    vector_dict = create_vectors(templates, schema_dict)
+    # Get logical vectors for query templates, by their IDs
+    vectors = create_vectors(sorted(templates.values()), schema_dict)
+    vector_dict = {template_id: vectors[template] for template_id, template in templates.items()}
 
     num_clusters, assignment_dict, cluster_totals = OnlineClustering(min_date, max_date, data,
             total_queries, float(args['rho']), vector_dict)
@@ -9,6 +9,7 @@ import numpy as np
 import math
 import time
 import os
+import sys
 import csv
 import argparse
 import matplotlib.pyplot as plt
@@ -23,6 +24,10 @@ from datetime import datetime, timedelta
 
 from sortedcontainers import SortedDict
 
+# The timestamp parser shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from timestamp_parser import GetMinuteParser
+
 import Utilities
 
 from spectral import Two_Stage_Regression
@@ -172,6 +177,7 @@ def LoadData(file_path, aggregate):
     trajs = dict()
 
     datetime_format = "%Y-%m-%d %H:%M:%S" # Strip milliseconds ".%f"
+    parse_minute = GetMinuteParser(datetime_format).Parse
     for csv_file in sorted(os.listdir(file_path)):
         print(csv_file)
 
@@ -186,7 +192,7 @@ def LoadData(file_path, aggregate):
 
             for line in reader:
                 count = float(line[1])
-                ts = datetime.strptime(line[0], datetime_format)
+                ts = parse_minute(line[0])
                 hour = ts.hour
                 if aggregate > 60:
                     hour //= aggregate // 60
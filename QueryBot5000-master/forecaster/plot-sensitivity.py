@@ -17,6 +17,10 @@ from datetime import datetime, timedelta
 import seaborn as sns
 from sortedcontainers import SortedDict
 
+# The template file names shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from template_registry import TemplateFileId
+
 DATA_DICT = {'admission': "~/peloton-tf/time-series-clustering/admission-combined-results/",
         'oli': "~/peloton-tf/time-series-clustering/oli-combined-results/",
         'tiramisu': '~/peloton-tf/time-series-clustering/tiramisu-combined-results/',
@@ -90,6 +94,7 @@ def PlotLineChart(xaxis, data, name, xlabel, ylabel, color):
 
 
 def LoadData(input_path):
+    # The templates are keyed by their IDs, as in the clustering assignments
     total_queries = dict()
     templates = []
     min_date = datetime.max
@@ -99,27 +104,28 @@ def LoadData(input_path):
 
     for csv_file in sorted(os.listdir(os.path.expanduser(input_path))):
         print(csv_file)
+        template_id = TemplateFileId(csv_file)
+        if template_id is None:
+            # Not a template, e.g. the dedup report of the combiner
+            continue
         with open(os.path.expanduser(input_path) + "/" + csv_file, 'r') as f:
             reader = csv.reader(f)
             queries, template = next(reader)
 
-            # To make the matplotlib work...
-            template = template.replace('$', '')
-
             # Assume we already filtered out other types of queries when combining template csvs
             #statement = template.split(' ',1)[0]
             #if not statement in STATEMENTS:
             #    continue
 
             #print queries, template
-            total_queries[template] = int(queries)
+            total_queries[template_id] = int(queries)
             #print queries
 
-            templates.append(template)
+            templates.append(template_id)
 
             # add template
-            data[template] = SortedDict()
-            data_accu[template] = SortedDict()
+            data[template_id] = SortedDict()
+            data_accu[template_id] = SortedDict()
 
             total = 0
 
@@ -128,10 +134,10 @@ def LoadData(input_path):
                 time_stamp = datetime(ts.year, ts.month, ts.day, ts.hour, 0, 0)
                 count = int(line[1])
                 total += count
-                if not time_stamp in data[template]:
-                    data[template][time_stamp] = 0
-                data[template][time_stamp] += count
-                data_accu[template][time_stamp] = total
+                if not time_stamp in data[template_id]:
+                    data[template_id][time_stamp] = 0
+                data[template_id][time_stamp] += count
+                data_accu[template_id][time_stamp] = total
 
                 min_date = min(min_date, time_stamp)
                 max_date = max(max_date, time_stamp)
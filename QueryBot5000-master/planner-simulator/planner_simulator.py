@@ -16,6 +16,11 @@ from sortedcontainers import SortedDict
 
 from schemaParser import extract_tables_and_columns
 
+# The template store and registry shared with the pre-processor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pre-processor"))
+from template_store import TEMPLATE_STORE_SUFFIX, ReadTemplateStore
+from template_registry import TemplateRegistry, TemplateFileId
+
 class Simulator:
     """Index suggestion algorithm that simulates a basic "what-if" API
 
@@ -45,13 +50,13 @@ class Simulator:
         sql_schema = open(schema_file, 'r')
         self.schema_dict = extract_tables_and_columns(sql_schema)
 
-        self.data, self.total_queries, self.template_map = LoadOriginalData(original_path)
+        self.data, self.total_queries, self.templates = LoadOriginalData(original_path)
 
         self.predicted_data = LoadMultiplePredictedData(predicted_path)
 
         tables = self.schema_dict.keys()
 
-        self.templates_dict = GetAccessDict(sorted(self.template_map.values()), tables, self.schema_dict)
+        self.templates_dict = GetAccessDict(self.templates, tables, self.schema_dict)
 
         self.last_date = None
         # Clear the total_queries and calculate it online
@@ -65,7 +70,6 @@ class Simulator:
         total_queries = self.total_queries
         aggregate = self.aggregate
         column_card = self.column_card
-        template_map = self.template_map
         static_suggest = self.static_suggest
         data = self.data
 
@@ -84,7 +88,7 @@ class Simulator:
                 if self.total_queries[template] < 100:
                     continue
 
-                template_dict = self.templates_dict[template_map[template]]
+                template_dict = self.templates_dict[template]
                 weight = 10000
                 for pair in template_dict:
                     if pair in index_set:
@@ -139,20 +143,21 @@ class Simulator:
             cnt = 0
             cnt2 = 0
             for template, cluster in assignments.items():
-                template_dict = self.templates_dict[template_map[template]]
+                template_dict = self.templates_dict[template]
 
                 cnt2 += 1
                 if self.total_queries[template] < 100 or cluster not in clusters:
                     continue
                 cnt += 1
-                print(type(cluster), cluster, total_queries[template], template[:50])
+                print(type(cluster), cluster, total_queries[template],
+                        self.templates.Template(template)[:50])
 
                 weight = 10000
                 for pair in template_dict:
                     if pair in index_set:
                         weight = 1
 
-                print(template)
+                print(self.templates.Template(template))
                 print(weight, "\n")
 
 
@@ -215,31 +220,41 @@ def LoadOriginalData(input_path):
     max_date = datetime.min
     data = dict()
 
-    # This is to keep track of our modification to the template. We have to keep the original
-    # templates to restore the order in the clustering assignments.
-    modified_template_map = dict()
+    # The data is keyed by the template IDs, as the clustering assignments
+    # are, and the text of the templates is kept once
+    templates = TemplateRegistry()
 
     for csv_file in sorted(os.listdir(input_path)):
         print(csv_file)
+        if csv_file.endswith(TEMPLATE_STORE_SUFFIX):
+            # A template store holds what the csv files of the directory would
+            for template_id, template, time_stamps, counts in ReadTemplateStore(input_path +
+                    "/" + csv_file):
+                # To make the matplotlib work...
+                templates.Add(template.replace('$', ''), template_id)
+                total_queries[template_id] = sum(counts)
+                data[template_id] = SortedDict(zip(time_stamps, counts))
+
+                min_date = min(min_date, time_stamps[0])
+                max_date = max(max_date, time_stamps[-1])
+            continue
+
+        template_id = TemplateFileId(csv_file)
+        if template_id is None:
+            # Not a template, e.g. the dedup report of the combiner
+            continue
         with open(input_path + "/" + csv_file, 'r') as f:
             reader = csv.reader(f)
             queries, template = next(reader)
 
             # To make the matplotlib work...
-            template = template.replace('$', '')
-
-            modified_template = template
-            # replace '#' with 'param_holder' for sql parsing
-            modified_template = modified_template.replace('#', "param_holder")
-            # convert to lower case for matching convenience
-            #modified_template = modified_template.lower()
-            modified_template_map[template] = modified_template
+            templates.Add(template.replace('$', ''), template_id)
 
             #print queries, template
-            total_queries[template] = int(queries)
+            total_queries[template_id] = int(queries)
 
             # add template
-            data[template] = SortedDict()
+            data[template_id] = SortedDict()
 
             #continue
             
@@ -247,12 +262,12 @@ def LoadOriginalData(input_path):
                 time_stamp = datetime.strptime(line[0], datetime_format)
                 count = int(line[1])
 
-                data[template][time_stamp] = count
+                data[template_id][time_stamp] = count
 
                 min_date = min(min_date, time_stamp)
                 max_date = max(max_date, time_stamp)
 
-    return data, total_queries, modified_template_map
+    return data, total_queries, templates
 
 
 def LoadData(file_path, aggregate):
@@ -304,9 +319,14 @@ def BuildDictionary(schema_dict):
     return d
 
 def GetAccessDict(templates, tables, schema_dict):
+    # The columns accessed by every template of the registry, by its ID
     templates_dict = dict()
 
-    for template in templates:
+    for template_id in sorted(templates):
+        # replace '#' with 'param_holder' for sql parsing
+        template = templates.Template(template_id).replace('#', "param_holder")
+        # convert to lower case for matching convenience
+        #template = template.lower()
         #print("processing template: %s" % template)
         sql = sqlparse.parse(template)[0]
         token_list = [str(x) for x in sql.flatten()]
@@ -385,7 +405,7 @@ def GetAccessDict(templates, tables, schema_dict):
             if token == 'where' or token == 'WHERE':
                 within_where_clause = True
 
-        templates_dict[template] = token_set
+        templates_dict[template_id] = token_set
         #print(token_set)
 
     return templates_dict
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3.5
+
+import sys
+import os
+import glob
+import gzip
+import csv
+import re
+import time
+import argparse
+
+import templatizer
+
+csv.field_size_limit(sys.maxsize)
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiramisu-sample")
+
+def LegacyTemplate(query):
+    # GetTemplate before the single-pass normalizer: four regex strings
+    # looked up in the re cache and applied one after another
+    STRING_REGEX = r'([^\\])\'((\')|(.*?([^\\])\'))'
+    DOUBLE_QUOTE_STRING_REGEX = r'([^\\])"((")|(.*?([^\\])"))'
+
+    INT_REGEX = r'([^a-zA-Z])-?\d+(\.\d+)?' # To prevent us from capturing table name like "a1"
+
+    HASH_REGEX = r'(\'\d+\\.*?\')'
+
+    template = re.sub(HASH_REGEX, r"@@@", query)
+    template = re.sub(STRING_REGEX, r"\1&&&", template)
+    template = re.sub(DOUBLE_QUOTE_STRING_REGEX, r"\1&&&", template)
+    template = re.sub(INT_REGEX, r"\1#", template)
+    return template
+
+def ReadQueries(path, config, max_log):
+    # The queries of a file as ProcessData hands them to GetTemplate
+    queries = []
+    with gzip.open(path, mode='rt') as f:
+        for i, query_info in enumerate(csv.reader(f, delimiter=',')):
+            if max_log is not None and i >= max_log:
+                break
+            if config['mysql'] and query_info[config['type_index']] != 'Query':
+                continue
+
+            query = query_info[config['query_index']]
+            for stmt in templatizer.STATEMENTS:
+                idx = query.find(stmt)
+                if idx >= 0:
+                    break
+            if idx >= 0:
+                queries.append(query[idx:])
+    return queries
+
+def Measure(func, queries, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        templates = [func(query) for query in queries]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, templates
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Benchmark the template extraction of the '
+            'templatizer')
+    aparser.add_argument('project', nargs='?', default='tiramisu',
+            choices=templatizer.PROJECTS.keys(), help='Data source type')
+    aparser.add_argument('--dir', default=SAMPLE_DIR, help='Input Data Directory')
+    aparser.add_argument('--max_log', type=int, help='Maximum number of logs to read in a '
+            'data file. Read the whole file if not provided')
+    aparser.add_argument('--repeat', type=int, default=1, help='Number of runs per file, the '
+            'best one is reported')
+    args = vars(aparser.parse_args())
+
+    config = templatizer.PROJECTS[args['project']]
+    files = sorted(glob.glob(os.path.join(args['dir'], config['files'])))
+
+    total_queries = 0
+    total_fast = 0
+    total_before = 0.0
+    total_after = 0.0
+    mismatches = 0
+    for path in files:
+        queries = ReadQueries(path, config, args['max_log'])
+        before, expected = Measure(LegacyTemplate, queries, args['repeat'])
+        after, templates = Measure(templatizer.ExtractTemplate, queries, args['repeat'])
+
+        for query, old, new in zip(queries, expected, templates):
+            if old != new:
+                mismatches += 1
+                if mismatches <= 10:
+                    print("MISMATCH: %r\n  before: %r\n  after:  %r" % (query, old, new))
+        total_fast += sum(1 for query in queries if templatizer.FastTemplate(query) is not None)
+        total_queries += len(queries)
+        total_before += before
+        total_after += after
+        print("%s: %d queries, %.0f -> %.0f queries/sec" % (os.path.basename(path),
+            len(queries), len(queries) / before if before > 0 else 0,
+            len(queries) / after if after > 0 else 0))
+
+    if total_queries == 0:
+        print("No queries found in %s" % args['dir'])
+        sys.exit(1)
+    print("Total: %d queries, %d on the fast path, %d mismatches" % (total_queries, total_fast,
+        mismatches))
+    print("before:          %12.0f queries/sec" % (total_queries / total_before))
+    print("ExtractTemplate: %12.0f queries/sec" % (total_queries / total_after))
+    print("Speedup: %.2fx" % (total_before / total_after))
+    if mismatches > 0:
+        sys.exit(1)
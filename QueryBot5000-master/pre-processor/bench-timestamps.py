@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.5
+
+import sys
+import os
+import glob
+import gzip
+import csv
+import datetime
+import time
+import argparse
+
+import templatizer
+from timestamp_parser import MinuteParser
+
+csv.field_size_limit(sys.maxsize)
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiramisu-sample")
+COMBINED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "clusterer",
+        "combined-results")
+
+def ReadLogTimestamps(path, max_log):
+    # The timestamps of a log file as ProcessRows hands them to the parser
+    time_stamps = []
+    with gzip.open(path, mode='rt') as f:
+        for i, query_info in enumerate(csv.reader(f, delimiter=',')):
+            if max_log is not None and i >= max_log:
+                break
+            time_stamps.append(query_info[0][: -8])
+    return time_stamps
+
+def ReadTemplateTimestamps(input_dir):
+    # The timestamps of the template csv files read by the combiner and the
+    # clusterer
+    time_stamps = []
+    for path in sorted(glob.glob(os.path.join(input_dir, "*", "*template*.csv"))):
+        with open(path, 'r') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            time_stamps.extend(line[0] for line in reader)
+    return time_stamps
+
+def StrptimeMinute(time_stamp, time_stamp_format):
+    time_stamp = datetime.datetime.strptime(time_stamp, time_stamp_format)
+    return time_stamp.replace(second=0)
+
+def Measure(name, time_stamps, time_stamp_format, repeat):
+    best = None
+    for i in range(repeat):
+        # A new parser every run, so its caches start empty
+        parse = MinuteParser(time_stamp_format).Parse
+        start = time.perf_counter()
+        minutes = [parse(time_stamp) for time_stamp in time_stamps]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    before = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        expected = [StrptimeMinute(time_stamp, time_stamp_format) for time_stamp in time_stamps]
+        elapsed = time.perf_counter() - start
+        before = elapsed if before is None else min(before, elapsed)
+
+    mismatches = sum(1 for a, b in zip(minutes, expected) if a != b)
+    print("%-10s %10d rows   strptime %10.0f rows/sec   MinuteParser %10.0f rows/sec   "
+            "%.2fx   %d mismatches" % (name, len(time_stamps), len(time_stamps) / before,
+            len(time_stamps) / best, before / best, mismatches))
+    return mismatches
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Benchmark the minute timestamp parsing of '
+            'the templatizer, the combiner and the clusterer')
+    aparser.add_argument('--dir', default=SAMPLE_DIR, help='Input Data Directory of the '
+            'templatizer')
+    aparser.add_argument('--combined_dir', default=COMBINED_DIR, help='Directory of combined '
+            'template csv files')
+    aparser.add_argument('--max_log', type=int, help='Maximum number of logs to read in a '
+            'data file. Read the whole file if not provided')
+    aparser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one '
+            'is reported')
+    args = vars(aparser.parse_args())
+
+    config = templatizer.PROJECTS['tiramisu']
+    log_timestamps = []
+    for path in sorted(glob.glob(os.path.join(args['dir'], config['files']))):
+        log_timestamps.extend(ReadLogTimestamps(path, args['max_log']))
+    template_timestamps = ReadTemplateTimestamps(args['combined_dir'])
+
+    mismatches = 0
+    for name, time_stamps in [("logs", log_timestamps), ("templates", template_timestamps)]:
+        if len(time_stamps) == 0:
+            print("%-10s no timestamps found" % name)
+            continue
+        mismatches += Measure(name, time_stamps, config['time_stamp_format'], args['repeat'])
+    if mismatches > 0:
+        sys.exit(1)
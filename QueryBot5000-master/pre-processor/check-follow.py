@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import glob
+import shutil
+import tempfile
+import subprocess
+import collections
+
+TEMPLATIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templatizer.py")
+
+# A live tiramisu log as (minute, query), with queries of minutes already
+# written: one added to the last row of a template, and one to an earlier row
+SAMPLE_LOG = [
+    ("00:00", "select a from t"),
+    ("00:01", "select a from t"),
+    ("00:00", "select a from t"),
+    ("00:02", "select a from t"),
+    ("00:03", "select b from u"),
+    ("00:04", "select a from t"),
+    ("00:01", "select a from t"),
+    ("00:05", "select a from t"),
+    ("00:03", "select b from u"),
+]
+
+def LogLines(log):
+    for i, (minute, query) in enumerate(log):
+        time_stamp = "2016-11-30 %s:%02d.000 EST" % (minute, i)
+        yield '"%s","1","%s","statement: %s",""\n' % (time_stamp, time_stamp, query)
+
+def CheckFile(path, expected):
+    # One row per minute in order, after the number of their queries
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        queries, template = next(reader)
+        rows = [(time_stamp, int(count)) for time_stamp, count in reader]
+
+    errors = []
+    minutes = [time_stamp for time_stamp, count in rows]
+    if minutes != sorted(set(minutes)):
+        errors.append("minutes not in order or repeated: %s" % minutes)
+    if int(queries) != sum(count for time_stamp, count in rows):
+        errors.append("header count %s is not the sum of the rows" % queries)
+    if dict(rows) != expected.get(template):
+        errors.append("rows %s instead of %s" % (rows, expected.get(template)))
+
+    for error in errors:
+        print("MISMATCH in %s (%s): %s" % (os.path.basename(path), template, error))
+    return not errors
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    expected = collections.defaultdict(collections.Counter)
+    for minute, query in SAMPLE_LOG:
+        expected[query]["2016-11-30 %s:00" % minute] += 1
+
+    output_dir = tempfile.mkdtemp()
+    try:
+        subprocess.run([sys.executable, TEMPLATIZER_PATH, "tiramisu", "--follow", "-",
+                "--output", output_dir], input="".join(LogLines(SAMPLE_LOG)),
+                universal_newlines=True, stdout=subprocess.DEVNULL, check=True)
+
+        files = sorted(glob.glob(os.path.join(output_dir, "stdin", "template*.csv")))
+        results = [CheckFile(path, expected) for path in files]
+    finally:
+        shutil.rmtree(output_dir)
+
+    print("%d template files checked, %d with errors" % (len(files), results.count(False)))
+    if len(files) != len(expected) or not all(results):
+        sys.exit(1)
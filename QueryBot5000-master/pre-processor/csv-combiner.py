@@ -8,9 +8,16 @@ import csv
 import os
 import datetime
 import gzip
-import re
 import argparse
-from multiprocessing import Process
+import heapq
+import array
+from multiprocessing import Pool
+
+from timestamp_parser import EPOCH, GetMinuteParser
+from template_store import TEMPLATE_STORE_SUFFIX, TemplateStoreWriter, TemplateStore
+from template_registry import TemplateRegistry, FileManifest
+from template_normalizer import NORMALIZED_FILE, NormalizeTemplate
+from template_dedup import TemplateDeduplicator
 
 csv.field_size_limit(sys.maxsize)
 
@@ -18,115 +25,399 @@ STATEMENTS = ['select', 'SELECT', 'INSERT', 'insert', 'UPDATE', 'update', 'delet
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 TIME_STAMP_STEP = datetime.timedelta(minutes=1)
 
-def MakeCSVFiles(workload_dict, min_timestamp, max_timestamp, output_dir):
-    print("Generating CSV files...")
-    print(output_dir)
+OUTPUT_FORMATS = ["csv", "npz"]
 
-    # Create the result folder if not exists
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+# Number of shards of the templates per job, so that a shard with a large
+# template doesn't keep the other jobs waiting at the end
+SHARDS_PER_JOB = 4
 
-    # delete any old existing files
-    for old_file in os.listdir(output_dir):
-        os.remove(output_dir + old_file)
+# The text of the combined template IDs, written next to templates.txt
+REGISTRY_FILE = "template-registry.csv"
 
-    template_count = 0
-    for template in workload_dict:
-        template_timestamps = workload_dict[
-            template]  # time stamps for ith cluster
-        num_queries_for_template = sum(template_timestamps.values())
-
-        # write to csv file
-        with open(output_dir + 'template' + str(template_count) +
-                  ".csv", 'w') as csvfile:
-            template_writer = csv.writer(csvfile, dialect='excel')
-            template_writer.writerow([num_queries_for_template, template])
-            for entry in sorted(template_timestamps):
-                template_writer.writerow([entry, template_timestamps[entry]])
-        csvfile.close()
-        template_count += 1
-    
-    print("Template count: " + str(template_count))
-
-def AddEntry(template, reader, min_timestamp, max_timestamp, templated_workload):
-
-    # Finer process the template a bit to reduce the total template numbers
-    template = re.sub(r"&&&", r"#", template)
-    template = re.sub(r"@@@", r"#", template)
-    template = re.sub(r"[nN]ull", r"#", template)
-    template = re.sub(r"NULL", r"#", template)
-    template = re.sub(r"\s+", r" ", template)
-    template = re.sub(r"\( ", r"(", template)
-    template = re.sub(r" \)", r")", template)
-    template = re.sub(r"([^ ])\(", r"\1 (", template)
-    template = re.sub(r"\)([^ ])", r") \1", template)
-    template = re.sub(r" IN \([^\(]*?\)", r" IN ()", template)
-    template = re.sub(r" in \([^\(]*?\)", r" IN ()", template)
-    template = re.sub(r"([=<>,!\?])([^ ])", r"\1 \2", template)
-    template = re.sub(r"([^ ])=", r"\1 =", template)
-
-    #if (template.find("gradAdmissions2#Test") > 0 and template.find("INSERT") >= 0 and
-    if (template.find("INSERT") >= 0 and
-            template.find("VALUES") > 0):
-        template = template[: template.find("VALUES") + 6]
-
-    for line in reader:
-        time_stamp = datetime.datetime.strptime(line[0], DATETIME_FORMAT)
-        count = int(line[1])
-
-        if not template in templated_workload:
-            # add template
-            templated_workload[template] = dict()
-
-        if time_stamp in templated_workload[template]:
-            templated_workload[template][time_stamp] += count
-        else:
-            templated_workload[template][time_stamp] = count
-
-        min_timestamp = min(min_timestamp, time_stamp)
-        max_timestamp = max(max_timestamp, time_stamp)
+# The inputs already merged by the incremental mode, kept next to the output
+# directory rather than in it, as the clusterers read every file there
+MANIFEST_SUFFIX = "-manifest.json"
 
-    return (templated_workload, min_timestamp, max_timestamp)
+# The near-duplicate templates collapsed into another one, written in the
+# output directory. The readers of the combined templates skip it, as its
+# name isn't that of a template file.
+DEDUP_REPORT_FILE = "dedup-report.csv"
 
+# The incremental mode writes the query count of a template zero padded to a
+# fixed width, so it can be updated in place as new days are appended
+HEADER_COUNT_WIDTH = 20
 
-def Combine(input_dir, output_dir):
+# The text of the templates seen, which the combined series are keyed by the
+# IDs of
+TEMPLATES = TemplateRegistry()
 
-    templated_workload = dict()
+# The template stores read by this process, by path
+STORES = dict()
 
-    min_timestamp = datetime.datetime.max
-    max_timestamp = datetime.datetime.min
+def LoadStore(path):
+    store = STORES.get(path)
+    if store is None:
+        store = TemplateStore(path)
+        STORES[path] = store
+    return store
 
+def InputFiles(input_dir):
     target = os.path.join(input_dir, "*/*template*.csv")
     print("New - Target input file with csv: ")
     print(target)
-    files = sorted([ x for x in glob.glob(target) ])
-    cnt = 0
+    return sorted([ x for x in glob.glob(target) ] +
+            glob.glob(os.path.join(input_dir, "*" + TEMPLATE_STORE_SUFFIX)))
+
+def InputDay(path):
+    # The day an input file belongs to: the directory of templatizer csv
+    # files it is in, or the template store itself
+    if path.endswith(TEMPLATE_STORE_SUFFIX):
+        return path
+    return os.path.dirname(path)
+
+def FindSources(files, normalized):
+    # Reads the template of every input, without its series. Returns the
+    # sources of the series of every normalized template ID, in the order
+    # the templates are first seen: the paths of the csv files and the
+    # (store path, index) of the templates of the stores.
+    sources = dict()
+
     for x in files:
         print("New - x in files: ")
         print(x)
+        if x.endswith(TEMPLATE_STORE_SUFFIX):
+            # The arrays of a store take a few bytes per minute, so the
+            # stores are kept loaded until the merge
+            store = LoadStore(x)
+            # Add the templates in the order of their sorted templateN.csv
+            # names, so the result is the same as from the csv files
+            for i in sorted(range(len(store)), key=lambda i: "template%d.csv" % store.Id(i)):
+                AddSource(store.Template(i), (x, i), normalized, sources)
+            continue
+
         with open(x, 'r') as f:
             reader = csv.reader(f)
             queries, template = next(reader)
             #statement = template.split(' ',1)[0]
             #if not statement in STATEMENTS:
             #    continue
+        AddSource(template, x, normalized, sources)
+
+    return sources
+
+def AddSource(template, source, normalized, sources):
+    # Finer process the template a bit to reduce the total template numbers,
+    # unless the templatizer did it already
+    if not normalized:
+        template = NormalizeTemplate(template)
+
+    template_id = TEMPLATES.Add(template)
+    if template_id in sources:
+        sources[template_id].append(source)
+    else:
+        sources[template_id] = [source]
+
+def CollapseNearDuplicates(sources, threshold, existing):
+    # Merges the sources of every template into those of the first template
+    # seen that is at least threshold similar to it. The templates already
+    # combined come first. Returns the sources and the (representative,
+    # template, similarity) of every template collapsed.
+    dedup = TemplateDeduplicator(threshold)
+    for template_id in existing:
+        dedup.AddRepresentative(template_id, TEMPLATES.Template(template_id))
+
+    collapsed_sources = dict()
+    collapsed = []
+    for template_id, template_sources in sources.items():
+        representative, similarity = dedup.Add(template_id, TEMPLATES.Template(template_id))
+        if representative != template_id:
+            collapsed.append((representative, template_id, similarity))
+        if representative in collapsed_sources:
+            collapsed_sources[representative].extend(template_sources)
+        else:
+            collapsed_sources[representative] = list(template_sources)
+    return collapsed_sources, collapsed
+
+def WriteDedupReport(collapsed, num_templates, path, append=False):
+    # An incremental run appends the templates it collapsed to the report of
+    # the earlier runs
+    print("Collapsed %d near-duplicate templates, %d series left of %d" % (len(collapsed),
+        num_templates - len(collapsed), num_templates))
+    append = append and os.path.exists(path)
+    with open(path, 'a' if append else 'w') as csvfile:
+        report_writer = csv.writer(csvfile, dialect='excel')
+        if not append:
+            report_writer.writerow(["similarity", "template", "collapsed template"])
+        for representative, template_id, similarity in collapsed:
+            report_writer.writerow(["%.3f" % similarity, TEMPLATES.Template(representative),
+                TEMPLATES.Template(template_id)])
+
+def ReadSeries(source):
+    # Yields the (epoch minute, count) pairs of a source, sorted if the
+    # input is
+    if isinstance(source, tuple):
+        path, i = source
+        store = LoadStore(path)
+        yield from zip(store.Minutes(i).tolist(), store.Counts(i).tolist())
+        return
+
+    epoch_minute = GetMinuteParser(DATETIME_FORMAT).EpochMinute
+    with open(source, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for line in reader:
+            yield epoch_minute(line[0]), int(line[1])
+
+def MergeSeries(sources):
+    # k-way merge of the series of a template, summing the counts of the
+    # same minute. The series of the templatizer are sorted, but those
+    # appended by --follow can have late rows, so an out of order minute
+    # makes the merged series be sorted again.
+    minutes = []
+    counts = []
+    in_order = True
+    for minute, count in heapq.merge(*[ReadSeries(source) for source in sources]):
+        if minutes and minute <= minutes[-1]:
+            if minute == minutes[-1]:
+                counts[-1] += count
+                continue
+            in_order = False
+        minutes.append(minute)
+        counts.append(count)
+
+    if not in_order:
+        template_timestamps = dict()
+        for minute, count in zip(minutes, counts):
+            template_timestamps[minute] = template_timestamps.get(minute, 0) + count
+        minutes = sorted(template_timestamps)
+        counts = [template_timestamps[minute] for minute in minutes]
+    return minutes, counts
+
+def PrepareOutputDir(output_dir):
+    # Create the result folder if not exists
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # delete any old existing files
+    for old_file in os.listdir(output_dir):
+        os.remove(output_dir + old_file)
 
-            templated_workload, min_timestamp, max_timestamp = AddEntry(template, reader,
-                    min_timestamp, max_timestamp, templated_workload)
+def WriteCSVFile(template_id, minutes, counts, output_dir, padded=False):
+    # write to csv file, named by the stable ID of the template
+    num_queries = sum(counts)
+    if padded:
+        num_queries = "%0*d" % (HEADER_COUNT_WIDTH, num_queries)
+    with open(output_dir + 'template' + str(template_id) +
+              ".csv", 'w') as csvfile:
+        template_writer = csv.writer(csvfile, dialect='excel')
+        template_writer.writerow([num_queries, TEMPLATES.Template(template_id)])
+        template_writer.writerows(zip((EPOCH + datetime.timedelta(minutes=minute)
+            for minute in minutes), counts))
 
-        cnt += 1
-        #if cnt == 1000:
-        #    break
+def ReadLastRow(f):
+    # The offset, the minute and the count of the last row of a combined csv
+    # file, or None if it can't be read
+    size = f.seek(0, os.SEEK_END)
+    start = max(0, size - 4096)
+    f.seek(start)
+    data = f.read().rstrip(b"\r\n")
+    idx = data.rfind(b"\n")
+    if idx < 0:
+        return None
+    try:
+        time_stamp, count = data[idx + 1:].decode('utf-8').split(',')
+        minute = GetMinuteParser(DATETIME_FORMAT).EpochMinute(time_stamp)
+        return start + idx + 1, minute, int(count)
+    except ValueError:
+        return None
+
+def UpdateCSVFile(template_id, minutes, counts, output_dir):
+    # Adds the series of a new day to the combined csv file of a template.
+    # The rows are appended and the padded count updated in place, unless
+    # the day doesn't come after the rows already there.
+    path = output_dir + 'template' + str(template_id) + ".csv"
+    if not os.path.exists(path):
+        WriteCSVFile(template_id, minutes, counts, output_dir, padded=True)
+        return
+
+    with open(path, 'r+b') as f:
+        header = f.read(HEADER_COUNT_WIDTH + 1)
+        last_row = ReadLastRow(f)
+        if (header[:HEADER_COUNT_WIDTH].isdigit() and header[HEADER_COUNT_WIDTH:] == b',' and
+                last_row is not None and minutes[0] >= last_row[1]):
+            offset, last_minute, last_count = last_row
+            num_queries = int(header[:HEADER_COUNT_WIDTH]) + sum(counts)
+            if minutes[0] == last_minute:
+                # A minute split between two days
+                f.truncate(offset)
+                counts = [last_count + counts[0]] + counts[1:]
+            f.seek(0)
+            f.write(b"%0*d" % (HEADER_COUNT_WIDTH, num_queries))
+            f.seek(0, os.SEEK_END)
+            f.write("".join("%s,%d\r\n" % (EPOCH + datetime.timedelta(minutes=minute), count)
+                for minute, count in zip(minutes, counts)).encode('utf-8'))
+            return
+
+    # Merge the whole series again
+    template_timestamps = dict(zip(minutes, counts))
+    for minute, count in ReadSeries(path):
+        template_timestamps[minute] = template_timestamps.get(minute, 0) + count
+    minutes = sorted(template_timestamps)
+    WriteCSVFile(template_id, minutes, [template_timestamps[minute] for minute in minutes],
+            output_dir, padded=True)
+
+def ReadCombinedTemplates(output_dir):
+    # Adds the templates of the combined csv files to TEMPLATES, and returns
+    # their IDs
+    template_ids = []
+    for path in sorted(glob.glob(output_dir + "template*.csv")):
+        with open(path, 'r') as f:
+            queries, template = next(csv.reader(f))
+        template_ids.append(TEMPLATES.Add(template))
+    return template_ids
+
+def MergeShard(task):
+    # Merges the series of the templates of a shard, in a pool worker or in
+    # the main process. The csv files are written right away, while the
+    # series for a store are handed back to be written in order.
+    shard, output_dir, output_format, incremental = task
+    merged = []
+    for template_id, template, template_sources in shard:
+        TEMPLATES.Add(template, template_id)
+        minutes, counts = MergeSeries(template_sources)
+        if not minutes:
+            continue
+        if output_format == "npz":
+            merged.append((template_id, minutes[0], minutes[-1], array.array('i', minutes),
+                array.array('i', counts)))
+        elif incremental:
+            UpdateCSVFile(template_id, minutes, counts, output_dir)
+            merged.append((template_id, minutes[0], minutes[-1], None, None))
+        else:
+            WriteCSVFile(template_id, minutes, counts, output_dir)
+            merged.append((template_id, minutes[0], minutes[-1], None, None))
+    return merged
+
+def Combine(input_dir, output_dir, output_format="csv", jobs=1, incremental=False,
+        dedup_threshold=None):
+    # Only the templates of the inputs are read up front. The series of one
+    # template at a time are then merged from all the inputs and written
+    # out, so the memory is bounded by the largest template rather than
+    # the whole workload. With more than one job, the templates are split
+    # into shards by their ID and the shards merged by a pool.
+    #
+    # The incremental mode only merges the days not merged into the output
+    # csv files yet, and appends them to what is there. With a
+    # dedup_threshold, near-duplicate templates are combined into one.
+    normalized = os.path.exists(os.path.join(input_dir, NORMALIZED_FILE))
+    if normalized:
+        print("The templates are normalized already")
+    files = InputFiles(input_dir)
+
+    existing = []
+    if incremental:
+        manifest_path = output_dir.rstrip('/') + MANIFEST_SUFFIX
+        manifest = FileManifest(manifest_path)
+        settings = {'normalized': normalized, 'dedup_threshold': dedup_threshold}
+        days = sorted(set(InputDay(x) for x in files))
+        # A day merged before that has changed since can't be taken back out
+        changed = [day for day in days if os.path.basename(day) in manifest.files and
+                not manifest.IsDone(day, **settings)]
+        if len(manifest) == 0 or changed or not os.path.isdir(output_dir):
+            print("Combining all %d days, %d of them changed since the last run" % (len(days),
+                len(changed)))
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            manifest = FileManifest(manifest_path)
+        else:
+            existing = ReadCombinedTemplates(output_dir)
+        new_days = [day for day in days if not manifest.IsDone(day, **settings)]
+        print("%d of %d days already combined into %d templates" % (len(days) - len(new_days),
+            len(days), len(existing)))
+        if not new_days:
+            print("No new days - exiting")
+            return
+        new_day_set = set(new_days)
+        files = [x for x in files if InputDay(x) in new_day_set]
+
+    sources = FindSources(files, normalized)
+    if dedup_threshold is not None:
+        num_templates = len(set(sources) | set(existing))
+        sources, collapsed = CollapseNearDuplicates(sources, dedup_threshold, existing)
+
+    if output_format == "npz":
+        store_writer = TemplateStoreWriter(output_dir + 'templates' + TEMPLATE_STORE_SUFFIX)
+    else:
+        print("Generating CSV files...")
+        print(output_dir)
+        if not existing:
+            PrepareOutputDir(output_dir)
+
+    templates = [(template_id, TEMPLATES.Template(template_id), template_sources)
+            for template_id, template_sources in sources.items()]
+    results = dict()
+    if jobs <= 1:
+        for result in MergeShard((templates, output_dir, output_format, incremental)):
+            results[result[0]] = result
+    else:
+        num_shards = jobs * SHARDS_PER_JOB
+        shards = [[] for i in range(num_shards)]
+        for template in templates:
+            shards[template[0] % num_shards].append(template)
+        tasks = [(shard, output_dir, output_format, incremental) for shard in shards if shard]
+        print("Merging %d templates in %d shards with %d jobs" % (len(templates), len(tasks),
+            jobs))
+        with Pool(jobs) as pool:
+            for merged in pool.imap_unordered(MergeShard, tasks):
+                for result in merged:
+                    results[result[0]] = result
+
+    # The templates in the order they were first seen, whatever the shards
+    min_minute = None
+    max_minute = None
+    combined = []
+    for template_id in sources:
+        if template_id not in results:
+            continue
+        combined.append(template_id)
+        template_id, first, last, minutes, counts = results.pop(template_id)
+        min_minute = first if min_minute is None else min(min_minute, first)
+        max_minute = last if max_minute is None else max(max_minute, last)
+        if output_format == "npz":
+            store_writer.Add(template_id, TEMPLATES.Template(template_id), minutes, counts)
+
+    if output_format == "npz":
+        store_writer.Close()
+    else:
+        print("Template count: " + str(len(combined)))
+
+    # The report goes with the output it describes, written once the output
+    # directory exists. Without dedup, a report of an earlier run is stale.
+    report_path = output_dir + DEDUP_REPORT_FILE
+    if dedup_threshold is not None:
+        WriteDedupReport(collapsed, num_templates, report_path, append=bool(existing))
+    elif os.path.exists(report_path):
+        os.remove(report_path)
+
+    if incremental:
+        # The days only go to the manifest once their rows are all written
+        for day in new_days:
+            manifest.Add(day, **settings)
+        existing_ids = set(existing)
+        combined = existing + [template_id for template_id in combined
+                if template_id not in existing_ids]
 
     print("New - Timestamps: ")
-    print(min_timestamp)
-    print(max_timestamp)
+    if combined:
+        print(EPOCH + datetime.timedelta(minutes=min_minute))
+        print(EPOCH + datetime.timedelta(minutes=max_minute))
     with open('templates.txt', 'w') as template_file:
-        [ template_file.write(t + "\n") for t in sorted(templated_workload.keys()) ]
-
-    print("New - call MakeCSVFiles")
-    MakeCSVFiles(templated_workload, min_timestamp, max_timestamp, output_dir)
+        [ template_file.write(t + "\n") for t in sorted(TEMPLATES.Template(template_id)
+            for template_id in combined) ]
 
+    registry = TemplateRegistry(REGISTRY_FILE)
+    registry.Update(TEMPLATES.Subset(combined))
+    registry.Save()
 
 
 
@@ -137,6 +428,22 @@ if __name__ == '__main__':
     aparser = argparse.ArgumentParser(description='Templated query csv combiner')
     aparser.add_argument('--input_dir', help='Input Data Directory')
     aparser.add_argument('--output_dir', help='Output Data Directory')
+    aparser.add_argument('--output_format', default="csv", choices=OUTPUT_FORMATS,
+            help='Write the combined templates to templateN.csv files, or to a single '
+            'compressed columnar .npz template store')
+    aparser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of '
+            'processes merging the templates')
+    aparser.add_argument('--incremental', action='store_true', help='Only combine the days '
+            'not combined into the output directory yet, and append them to its csv files')
+    aparser.add_argument('--dedup_threshold', type=float, help='Combine the templates whose '
+            'token shingles are at least this Jaccard similar into the first one seen. Off '
+            'if not provided')
     args = vars(aparser.parse_args())
 
-    Combine(args['input_dir'], args['output_dir'] + '/')
+    if args['incremental'] and args['output_format'] != "csv":
+        aparser.error("--incremental only appends to templateN.csv files")
+    if args['dedup_threshold'] is not None and not 0.0 < args['dedup_threshold'] <= 1.0:
+        aparser.error("--dedup_threshold must be in (0, 1]")
+
+    Combine(args['input_dir'], args['output_dir'] + '/', args['output_format'], args['jobs'],
+            args['incremental'], args['dedup_threshold'])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import re
+import random
+
+from template_registry import TemplateId
+
+# Groups near-duplicate templates that the normalizer leaves apart, such as
+# different alias names or IN list shapes. A template is a set of shingles of
+# SHINGLE_SIZE tokens, and MinHash signatures of these sets are banded for
+# locality sensitive hashing, so only the templates sharing a band are
+# compared. The Jaccard similarity of the shingles themselves decides.
+
+TOKEN_REGEX = re.compile(r"\w+|[^\w\s]")
+SHINGLE_SIZE = 3
+
+# Number of hash functions of a signature
+NUM_PERMUTATIONS = 128
+# The bands are chosen so a pair right at the threshold still shares a band
+# with at least this probability
+LSH_RECALL = 0.95
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+def Shingles(template):
+    tokens = TOKEN_REGEX.findall(template.lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        return frozenset([" ".join(tokens)])
+    return frozenset(" ".join(tokens[i: i + SHINGLE_SIZE])
+            for i in range(len(tokens) - SHINGLE_SIZE + 1))
+
+def Jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def LSHBands(num_permutations, threshold):
+    # The number of bands and of rows per band. The more rows, the fewer
+    # candidates, so the most rows that keep the recall at the threshold.
+    bands, rows = num_permutations, 1
+    for r in range(1, num_permutations + 1):
+        b = num_permutations // r
+        if 1.0 - (1.0 - threshold ** r) ** b >= LSH_RECALL:
+            bands, rows = b, r
+    return bands, rows
+
+class TemplateDeduplicator(object):
+    # Maps every template added to the first template added before it that
+    # is at least threshold similar, or to itself. Only these representatives
+    # are indexed, so the groups don't chain into each other.
+
+    def __init__(self, threshold, num_permutations=NUM_PERMUTATIONS, seed=1):
+        self.threshold = threshold
+        rnd = random.Random(seed)
+        self.permutations = [(rnd.randrange(1, MERSENNE_PRIME), rnd.randrange(MERSENNE_PRIME))
+                for i in range(num_permutations)]
+        self.bands, self.rows = LSHBands(num_permutations, threshold)
+        self.buckets = [dict() for i in range(self.bands)]
+        # The order of every representative and its shingles
+        self.representatives = dict()
+
+    def Signature(self, shingles):
+        hashes = [TemplateId(shingle) for shingle in shingles]
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations]
+
+    def Bands(self, shingles):
+        signature = self.Signature(shingles)
+        return [tuple(signature[i * self.rows: (i + 1) * self.rows]) for i in range(self.bands)]
+
+    def AddRepresentative(self, template_id, template, shingles=None, bands=None):
+        if shingles is None:
+            shingles = Shingles(template)
+            bands = self.Bands(shingles)
+        self.representatives[template_id] = (len(self.representatives), shingles)
+        for bucket, band in zip(self.buckets, bands):
+            bucket.setdefault(band, []).append(template_id)
+
+    def Add(self, template_id, template):
+        # Returns the ID of the representative of the template and their
+        # similarity
+        shingles = Shingles(template)
+        bands = self.Bands(shingles)
+
+        candidates = set()
+        for bucket, band in zip(self.buckets, bands):
+            candidates.update(bucket.get(band, ()))
+        best_id, best = None, 0.0
+        # Ties go to the representative added first
+        for order, candidate in sorted((self.representatives[candidate][0], candidate)
+                for candidate in candidates):
+            similarity = Jaccard(shingles, self.representatives[candidate][1])
+            if similarity > best:
+                best_id, best = candidate, similarity
+        if best_id is not None and best >= self.threshold:
+            return best_id, best
+
+        self.AddRepresentative(template_id, template, shingles, bands)
+        return template_id, 1.0
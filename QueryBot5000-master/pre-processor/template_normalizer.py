@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import re
+
+# Finer processing of the templates to reduce the total template numbers,
+# shared by the combiner, the templatizer and the planner simulator. The rules
+# are applied in order, each to the result of the previous one.
+NORMALIZE_RULES = [
+    (r"&&&", r"#"),
+    (r"@@@", r"#"),
+    (r"[nN]ull", r"#"),
+    (r"NULL", r"#"),
+    (r"\s+", r" "),
+    (r"\( ", r"("),
+    (r" \)", r")"),
+    (r"([^ ])\(", r"\1 ("),
+    (r"\)([^ ])", r") \1"),
+    (r" IN \([^\(]*?\)", r" IN ()"),
+    (r" in \([^\(]*?\)", r" IN ()"),
+    (r"([=<>,!\?])([^ ])", r"\1 \2"),
+    (r"([^ ])=", r"\1 ="),
+]
+
+# Number of distinct templates whose normalized form is kept per normalizer
+MAX_CACHED_TEMPLATES = 1 << 16
+
+# Marks a templatizer output directory with normalized templates. The rules
+# are not idempotent, so the combiner must not apply them a second time.
+NORMALIZED_FILE = "normalized"
+
+class TemplateNormalizer(object):
+    # The rules compiled once, with the normalized form of every template
+    # seen, since the same templates come back in every input file
+
+    def __init__(self, rules=NORMALIZE_RULES):
+        self.rules = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+        self.templates = dict()
+
+    def Normalize(self, template):
+        normalized = self.templates.get(template)
+        if normalized is None:
+            normalized = self.Apply(template)
+            if len(self.templates) >= MAX_CACHED_TEMPLATES:
+                self.templates.clear()
+            self.templates[template] = normalized
+        return normalized
+
+    def Apply(self, template):
+        for regex, replacement in self.rules:
+            template = regex.sub(replacement, template)
+
+        # Only keep the statement up to the values of an insert
+        #if (template.find("gradAdmissions2#Test") > 0 and template.find("INSERT") >= 0 and
+        if (template.find("INSERT") >= 0 and
+                template.find("VALUES") > 0):
+            template = template[: template.find("VALUES") + 6]
+        return template
+
+NORMALIZER = TemplateNormalizer()
+
+def NormalizeTemplate(template):
+    return NORMALIZER.Normalize(template)
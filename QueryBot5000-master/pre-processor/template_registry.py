@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import hashlib
+
+csv.field_size_limit(sys.maxsize)
+
+# The template dictionary shared by the stages of the pipeline, and the input
+# files already processed by an incremental run
+
+def TemplateId(template):
+    # A stable 64 bit hash of the template text. The sign bit is cleared, so
+    # the ID fits the int64 arrays of the template store and file names.
+    digest = hashlib.md5(template.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') & 0x7fffffffffffffff
+
+# The name of the csv file of a template, after its ID
+TEMPLATE_FILE_REGEX = re.compile(r"template(\d+)\.csv$")
+
+def TemplateFileId(file_name):
+    # The template ID in the name of a templateN.csv file, or None if it is
+    # not one
+    m = TEMPLATE_FILE_REGEX.match(os.path.basename(file_name))
+    if m is None:
+        return None
+    return int(m.group(1))
+
+class TemplateRegistry(object):
+    # The text of every template by its ID, so the text is kept once and the
+    # workloads are keyed by the ID. With a path, the templates are also kept
+    # in a csv file of id,template rows that only ever grows.
+
+    def __init__(self, path=None):
+        self.path = path
+        self.templates = dict()
+        self.unsaved = []
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', newline='') as f:
+                for template_id, template in csv.reader(f):
+                    self.templates[int(template_id)] = template
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __contains__(self, template_id):
+        return template_id in self.templates
+
+    def __iter__(self):
+        return iter(self.templates)
+
+    def Template(self, template_id):
+        return self.templates[template_id]
+
+    def Add(self, template, template_id=None):
+        # Returns the ID of the template
+        if template_id is None:
+            template_id = TemplateId(template)
+        known = self.templates.get(template_id)
+        if known is None:
+            self.templates[template_id] = template
+            if self.path is not None:
+                self.unsaved.append([template_id, template])
+        elif known != template:
+            raise Exception("Template ID %d of %r is already taken by %r" % (template_id,
+                template, known))
+        return template_id
+
+    def Update(self, templates):
+        # Adds the templates of a dict from ID to text
+        for template_id, template in templates.items():
+            self.Add(template, template_id)
+
+    def Subset(self, template_ids):
+        # The dict from ID to text of some of the templates, to hand them to
+        # another process
+        return {template_id: self.templates[template_id] for template_id in template_ids}
+
+    def Save(self):
+        # Appends the templates added since the last save
+        if not self.unsaved:
+            return
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f, dialect='excel').writerows(self.unsaved)
+        self.unsaved = []
+
+def FileState(path):
+    # The size and modification time of a file. A directory also has those
+    # of every file in it, as rewriting a file in place may not change the
+    # directory itself.
+    stat = os.stat(path)
+    state = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if os.path.isdir(path):
+        contents = dict()
+        for name in sorted(os.listdir(path)):
+            stat = os.stat(os.path.join(path, name))
+            contents[name] = [stat.st_size, stat.st_mtime]
+        state['contents'] = contents
+    return state
+
+class FileManifest(object):
+    # The input files, or directories of files, already processed with the
+    # state they had then, in a JSON file rewritten after every file
+
+    def __init__(self, path):
+        self.path = path
+        self.files = dict()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.files = json.load(f)['files']
+
+    def __len__(self):
+        return len(self.files)
+
+    def IsDone(self, path, **settings):
+        # Whether the file was processed as it is now, with the same settings
+        entry = self.files.get(os.path.basename(path))
+        if entry is None:
+            return False
+        if any(entry.get(key) != value for key, value in FileState(path).items()):
+            return False
+        return all(entry.get(key) == value for key, value in settings.items())
+
+    def Add(self, path, **info):
+        entry = FileState(path)
+        entry.update(info)
+        self.files[os.path.basename(path)] = entry
+        self.Save()
+
+    def Save(self):
+        # Replace the manifest at once, so a crash leaves the old one
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
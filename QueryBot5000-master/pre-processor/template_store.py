@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os
+import array
+import datetime
+import numpy as np
+
+from timestamp_parser import EPOCH
+
+# A columnar alternative to the templateN.csv files of MakeCSVFiles: all the
+# templates of a workload and their arrival series in a single .npz file.
+#
+#   template_bytes    the UTF-8 templates one after another, template i is
+#                     template_bytes[template_offsets[i]:template_offsets[i + 1]]
+#   template_offsets  int64, number of templates + 1
+#   series_offsets    int64, number of templates + 1
+#   minutes           int32, the sorted minutes since EPOCH of template i are
+#                     minutes[series_offsets[i]:series_offsets[i + 1]]
+#   counts            int32, the number of queries in each of these minutes
+#   template_ids      int64, the stable IDs of the templates, which also name
+#                     their templateN.csv files
+
+TEMPLATE_STORE_SUFFIX = ".npz"
+
+MINUTE = datetime.timedelta(minutes=1)
+
+def WriteTemplateStore(workload_dict, templates, path):
+    # workload_dict is keyed by the template IDs, and templates is the
+    # TemplateRegistry with their text
+    writer = TemplateStoreWriter(path)
+    for template_id, template_timestamps in workload_dict.items():
+        entries = sorted(template_timestamps)
+        writer.Add(template_id, templates.Template(template_id),
+                [(entry - EPOCH) // MINUTE for entry in entries],
+                [template_timestamps[entry] for entry in entries])
+    writer.Close()
+
+class TemplateStoreWriter(object):
+    # Builds a store one template at a time, with the series kept in compact
+    # arrays until the store is written
+
+    def __init__(self, path):
+        self.path = path
+        self.encoded = []
+        self.ids = array.array('q')
+        self.minutes = array.array('i')
+        self.counts = array.array('i')
+        self.series_offsets = array.array('q', [0])
+
+    def __len__(self):
+        return len(self.encoded)
+
+    def Add(self, template_id, template, minutes, counts):
+        # minutes are the sorted minutes since EPOCH of the series
+        self.encoded.append(template.encode('utf-8'))
+        self.ids.append(template_id)
+        self.minutes.extend(minutes)
+        self.counts.extend(counts)
+        self.series_offsets.append(len(self.minutes))
+
+    def Close(self):
+        print("Generating template store...")
+        print(self.path)
+
+        output_dir = os.path.dirname(self.path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        template_offsets = np.zeros(len(self.encoded) + 1, dtype=np.int64)
+        template_offsets[1:] = np.cumsum([len(template) for template in self.encoded])
+
+        # Only give the store its name once it is complete
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f,
+                    template_bytes=np.frombuffer(b"".join(self.encoded), dtype=np.uint8),
+                    template_offsets=template_offsets,
+                    series_offsets=np.array(self.series_offsets, dtype=np.int64),
+                    template_ids=np.array(self.ids, dtype=np.int64),
+                    minutes=np.array(self.minutes, dtype=np.int32),
+                    counts=np.array(self.counts, dtype=np.int32))
+        os.replace(tmp_path, self.path)
+
+        print("Template count: " + str(len(self.encoded)))
+
+class TemplateStore:
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.template_bytes = data['template_bytes'].tobytes()
+            self.template_offsets = data['template_offsets']
+            self.series_offsets = data['series_offsets']
+            self.template_ids = data['template_ids']
+            self.minutes = data['minutes']
+            self.counts = data['counts']
+
+    def __len__(self):
+        return len(self.template_offsets) - 1
+
+    def Template(self, i):
+        start, end = self.template_offsets[i], self.template_offsets[i + 1]
+        return self.template_bytes[start: end].decode('utf-8')
+
+    def Id(self, i):
+        return int(self.template_ids[i])
+
+    def Minutes(self, i):
+        # The epoch minutes of the arrival series of template i
+        return self.minutes[self.series_offsets[i]: self.series_offsets[i + 1]]
+
+    def Counts(self, i):
+        return self.counts[self.series_offsets[i]: self.series_offsets[i + 1]]
+
+    def Series(self, i):
+        # The arrival series of template i as the datetime and count lists
+        # the template csv files are read into
+        time_stamps = self.Minutes(i).astype('datetime64[m]').tolist()
+        return time_stamps, self.Counts(i).tolist()
+
+def ReadTemplateStore(path):
+    # Yields the ID and the text of every template of a store with its
+    # arrival series
+    store = TemplateStore(path)
+    for i in range(len(store)):
+        time_stamps, counts = store.Series(i)
+        yield store.Id(i), store.Template(i), time_stamps, counts
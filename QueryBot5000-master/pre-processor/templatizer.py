@@ -10,13 +10,67 @@ import datetime
 import gzip
 import re
 import argparse
-from multiprocessing import Process
+import itertools
+import stat
+import io
+from multiprocessing import Pool
+
+from timestamp_parser import GetMinuteParser
+from template_store import TEMPLATE_STORE_SUFFIX, WriteTemplateStore
+from template_registry import TemplateRegistry, FileManifest
+from template_normalizer import NORMALIZED_FILE, NormalizeTemplate
 
 csv.field_size_limit(sys.maxsize)
 
 TIME_STAMP_STEP = datetime.timedelta(minutes=1)
 STATEMENTS = ['select', 'SELECT', 'INSERT', 'insert', 'UPDATE', 'update', 'delete', 'DELETE']
 
+# The literals replaced in the templates, applied one after another
+STRING_REGEX = re.compile(r'([^\\])\'((\')|(.*?([^\\])\'))')
+DOUBLE_QUOTE_STRING_REGEX = re.compile(r'([^\\])"((")|(.*?([^\\])"))')
+INT_REGEX = re.compile(r'([^a-zA-Z])-?\d+(\.\d+)?') # To prevent us from capturing table name like "a1"
+HASH_REGEX = re.compile(r'(\'\d+\\.*?\')')
+
+# The same replacements in a single pass. Without backslashes and newlines
+# the string regexes come down to a quote, anything but a quote, and a quote.
+# A number right after a string is still replaced, as the replaced string
+# ends with a character that can precede it.
+LITERAL_REGEX = re.compile(
+    r"'[^']*'(-?\d+(?:\.\d+)?)?"
+    r'|"([^"]*)"(-?\d+(?:\.\d+)?)?'
+    r"|([^a-zA-Z])-?\d+(?:\.\d+)?")
+
+# Default memory budget of the template cache, counted in characters of the
+# cached queries
+TEMPLATE_CACHE_SIZE = 64 * 1024 * 1024
+# Queries too large to be worth caching, as a fraction of the budget
+TEMPLATE_CACHE_MAX_ENTRY_FRACTION = 16
+
+# Bytes of decompressed csv handed to a worker at a time when a file is
+# split, and read from the file at a time
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# One templateN.csv file per template, or a single template store per file
+OUTPUT_FORMATS = ["csv", "npz"]
+
+# The text of the template IDs of the output, and the state of the
+# incremental mode, in the output directory
+REGISTRY_FILE = "template-registry.csv"
+MANIFEST_FILE = "manifest.json"
+
+# Seconds between two looks at a followed log that has no new lines, and
+# without new lines for this long the open minute is written out as well
+FOLLOW_POLL_INTERVAL = 1.0
+FOLLOW_IDLE_FLUSH = 60.0
+
+# The time stamps of the template csv files
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The --follow mode writes the query count of a template zero padded to a
+# fixed width, so it can be updated in place as rows are appended
+HEADER_COUNT_WIDTH = 20
+
 # ==============================================
 # PROJECT CONFIGURATIONS
 # ==============================================
@@ -49,8 +103,88 @@ PROJECTS = {
     }
 }
 
+# ==============================================
+# ROW PARSERS
+# ==============================================
+
+# Every project names the parser of its log rows, its own name by default.
+# A parser is compiled from the project configuration into a function from
+# a csv row to its minute and statement, or None if the row has no query, so
+# the loop over the rows doesn't look at the configuration.
+
+def FindStatement(query):
+    for stmt in STATEMENTS:
+        idx = query.find(stmt)
+        if idx >= 0:
+            return query[idx:]
+    return None
+
+def TiramisuRowParser(config):
+    parse_minute = GetMinuteParser(config['time_stamp_format']).Parse
+    query_index = config['query_index']
+
+    def RowQuery(query_info):
+        # remove milliseconds and the time zone
+        time_stamp = parse_minute(query_info[0][: -8])
+        query = FindStatement(query_info[query_index])
+        if query is None:
+            return None
+        return time_stamp, query
+    return RowQuery
+
+def AdmissionsRowParser(config):
+    parse_minute = GetMinuteParser(config['time_stamp_format']).Parse
+    type_index = config['type_index']
+    query_index = config['query_index']
+
+    def RowQuery(query_info):
+        if query_info[type_index] != 'Query':  # skip if not a query
+            return None
+        # the day and the time without the milliseconds
+        time_stamp = parse_minute(query_info[0] + " " + query_info[1].split(".")[0])
+        query = FindStatement(query_info[query_index])
+        if query is None:
+            return None
+        return time_stamp, query
+    return RowQuery
+
+def OliRowParser(config):
+    parse_minute = GetMinuteParser(config['time_stamp_format']).Parse
+    type_index = config['type_index']
+    query_index = config['query_index']
+
+    def RowQuery(query_info):
+        if query_info[type_index] != 'Query':  # skip if not a query
+            return None
+        time_stamp = query_info[0]
+        if time_stamp[7] == ' ':
+            time_stamp = time_stamp[0: 7] + '0' + time_stamp[8: -1]
+        time_stamp = parse_minute(time_stamp)
+        query = FindStatement(query_info[query_index])
+        if query is None:
+            return None
+        return time_stamp, query
+    return RowQuery
+
+ROW_PARSERS = {
+    "tiramisu": TiramisuRowParser,
+    "admissions": AdmissionsRowParser,
+    "oli": OliRowParser,
+}
 
-def ProcessData(path, output_dir, num_logs, config):
+def RegisterRowParser(name, compile_parser):
+    # Adds the parser of a new log format, for the projects with
+    # "parser": name in their configuration
+    ROW_PARSERS[name] = compile_parser
+
+def CompileRowParser(config):
+    name = config.get('parser', config['name'])
+    if name not in ROW_PARSERS:
+        raise Exception("No row parser %r for project %r" % (name, config['name']))
+    return ROW_PARSERS[name](config)
+
+
+def ProcessData(path, output_dir, num_logs, config, output_format="csv"):
     # input: string of path to csv file
     # output: array of tuples
     #           tuple setup: (time_stamp, query)
@@ -59,104 +193,365 @@ def ProcessData(path, output_dir, num_logs, config):
     #over_all_start = time.time()
     #start = time.time()
 
+    templated_workload, processed_queries = TemplatizeData(path, num_logs, config)
+
+    WriteWorkload(templated_workload, path, output_dir, output_format)
+
+    #end = time.time()
+    #print("Preprocess and template extraction time for %s: %s" % (path, str(end - start)))
+
+    return processed_queries, TEMPLATES.Subset(templated_workload)
+
+def TemplatizeData(path, num_logs, config):
     print("Start processing: " + path)
 
-    data = []
-    processed_queries = 0
     templated_workload = dict()
 
-    min_timestamp = datetime.datetime.max
-    max_timestamp = datetime.datetime.min
+    # The cache itself is kept for the next file of this process
+    TEMPLATE_CACHE.ResetCounters()
 
     try:
-        f = gzip.open(path, mode='rt')
-        reader = csv.reader(f, delimiter=',')
-        
-        for query_info in reader:
-            processed_queries += 1
+        reader = ReadRows(path, num_logs)
+        processed_queries, error = ProcessRows(reader, config, templated_workload)
+    except Exception as e:
+        processed_queries, error = 0, e
 
-            if (not num_logs is None) and processed_queries > num_logs:
-                break
+    if error is not None:
+        print("It might be an incomplete file. But we continue anyway.")
+        print(error)
 
-            if config['name'] == 'tiramisu':
-                #print("chose tiramisu")
-                time_stamp = query_info[0]
-                time_stamp = time_stamp[: -8] # remove milliseconds and the time zone
+    print("Template cache for %s: %d hits, %d misses (%.1f%% hit rate)" % (path,
+        TEMPLATE_CACHE.hits, TEMPLATE_CACHE.misses, TEMPLATE_CACHE.HitRate()))
 
-            else:
-                if query_info[config['type_index']] != 'Query':  # skip if not a query
-                    continue
+    return templated_workload, processed_queries
 
-                # create timestamp
-                if config['name'] == 'admissions':
-                    day = query_info[0]
-                    time = query_info[1].split(".")[0]  # removes the milliseconds
-                    time_stamp = day + " " + time
-
-                if config['name'] == 'oli':
-                    time_stamp = query_info[0]
-                    if time_stamp[7] == ' ':
-                        time_stamp = time_stamp[0: 7] + '0' + time_stamp[8: -1]
-            #IF
-
-            time_stamp = datetime.datetime.strptime(
-                time_stamp, config['time_stamp_format'])
-            time_stamp = time_stamp.replace(second=0)  # accurate to the minute
-            # Format query
-            query = query_info[config['query_index']]
-
-            for stmt in STATEMENTS:
-                idx = query.find(stmt)
-                if idx >= 0:
-                    break
+def ReadRows(path, num_logs):
+    f = gzip.open(path, mode='rt')
+    reader = csv.reader(f, delimiter=',')
+    if num_logs is not None:
+        reader = itertools.islice(reader, num_logs)
+    return reader
 
-            if idx < 0:
+def ProcessRows(rows, config, templated_workload):
+    # Adds the queries of the csv rows to the templated workload. Returns the
+    # number of rows handled, and the exception that stopped it if any.
+    processed_queries = 0
+    row_query = CompileRowParser(config)
+
+    try:
+        for query_info in rows:
+            processed_queries += 1
+
+            row = row_query(query_info)
+            if row is None:
                 continue
-            
-            min_timestamp = min(min_timestamp, time_stamp)
-            max_timestamp = max(max_timestamp, time_stamp)
 
             # Update query templates
-            GetTemplate(query[idx:], time_stamp, templated_workload)
+            GetTemplate(row[1], row[0], templated_workload)
 
     except Exception as e:
-        print("It might be an incomplete file. But we continue anyway.")
-        print(e)
+        return processed_queries, e
 
+    return processed_queries, None
 
-    MakeCSVFiles(templated_workload, min_timestamp, max_timestamp, output_dir + '/' +
-            path.split('/')[-1].split('.gz')[0] + '/')
+def TimestampBounds(templated_workload):
+    # The first and the last minute with a query in the workload
+    min_timestamp = datetime.datetime.max
+    max_timestamp = datetime.datetime.min
+    for template_timestamps in templated_workload.values():
+        min_timestamp = min(min_timestamp, min(template_timestamps))
+        max_timestamp = max(max_timestamp, max(template_timestamps))
+    return min_timestamp, max_timestamp
 
-    #end = time.time()
-    #print("Preprocess and template extraction time for %s: %s" % (path, str(end - start)))
+def TemplateDir(path, output_dir):
+    return output_dir + '/' + path.split('/')[-1].split('.gz')[0] + '/'
 
-def GetTemplate(query, time_stamp, templated_workload):
-    # CHANGE: Returns a dictionary, where keys are templates, and they map to
-    # a map of timestamps map to query counts with that timestamp
-    #print("enter GetTemplate")
-    STRING_REGEX = r'([^\\])\'((\')|(.*?([^\\])\'))'
-    DOUBLE_QUOTE_STRING_REGEX = r'([^\\])"((")|(.*?([^\\])"))'
+def TemplateStorePath(path, output_dir):
+    return output_dir + '/' + path.split('/')[-1].split('.gz')[0] + TEMPLATE_STORE_SUFFIX
+
+def WriteWorkload(templated_workload, path, output_dir, output_format):
+    if output_format == "npz":
+        WriteTemplateStore(templated_workload, TEMPLATES, TemplateStorePath(path, output_dir))
+        return
+    min_timestamp, max_timestamp = TimestampBounds(templated_workload)
+    MakeCSVFiles(templated_workload, min_timestamp, max_timestamp, TemplateDir(path, output_dir))
+
+def ProcessFile(task):
+    # Runs ProcessData in a pool worker and tells how it went, with the text
+    # of the templates found
+    log_file, output_dir, max_log, config, output_format = task
+    start = time.time()
+    num_queries, templates = ProcessData(log_file, output_dir, max_log, config, output_format)
+    return log_file, num_queries, templates, time.time() - start
+
+def RecordEnds(piece, quoted):
+    # The offset after the last newline of the csv piece that ends a record,
+    # or 0, and whether the piece ends inside a quoted field. A newline
+    # inside a quoted field follows an odd number of quotes, as the csv
+    # module quotes whole fields and doubles the quotes inside them.
+    quoted_end = quoted ^ (piece.count(b'"') % 2 == 1)
+    # Step back over the newlines from the end of the piece, the last one
+    # usually ends a record
+    in_quotes = quoted_end
+    pos = len(piece)
+    while True:
+        newline = piece.rfind(b'\n', 0, pos)
+        if newline < 0:
+            return 0, quoted_end
+        in_quotes ^= piece.count(b'"', newline, pos) % 2 == 1
+        if not in_quotes:
+            return newline + 1, quoted_end
+        pos = newline
+
+def ReadBlocks(path, chunk_size):
+    # Yields the decompressed csv of the file in blocks of whole records of
+    # about chunk_size bytes, each with the exception that ended the input
+    # after it if any. The records are only cut apart here, the workers
+    # decode and parse them. Every piece read is scanned once, and the
+    # pieces are only joined into a block when it is handed out.
+    pieces = []
+    size = 0
+    # The end of the last whole record in the pieces, 0 if there is none
+    end = 0
+    quoted = False
+    try:
+        with gzip.open(path, mode='rb') as f:
+            while True:
+                piece = f.read(READ_SIZE)
+                if not piece:
+                    break
+                piece_end, quoted = RecordEnds(piece, quoted)
+                if piece_end > 0:
+                    end = size + piece_end
+                pieces.append(piece)
+                size += len(piece)
+                # Otherwise a single record is larger than a block so far
+                if size < chunk_size or end == 0:
+                    continue
+
+                data = b"".join(pieces)
+                yield data[:end], None
+                pieces = [data[end:]]
+                size -= end
+                end = 0
+    except Exception as e:
+        # Only the records read whole
+        yield b"".join(pieces)[:end], e
+        return
+    # The last record may not end with a newline
+    if size > 0:
+        yield b"".join(pieces), None
+
+def ProcessChunk(task):
+    # Templatizes a block of csv records in a pool worker into a partial
+    # workload. The block is decoded like the text files of ReadRows.
+    block, config = task
+    templated_workload = dict()
+    TEMPLATE_CACHE.ResetCounters()
+    rows = csv.reader(io.TextIOWrapper(io.BytesIO(block)), delimiter=',')
+    processed_queries, error = ProcessRows(rows, config, templated_workload)
+    return (templated_workload, TEMPLATES.Subset(templated_workload), processed_queries,
+            None if error is None else str(error), TEMPLATE_CACHE.hits, TEMPLATE_CACHE.misses)
+
+def MergeWorkload(templated_workload, partial_workload):
+    # The templates of the partial workload that are new go to the end, so
+    # merging the chunks in order keeps the order of the serial path
+    for template, template_timestamps in partial_workload.items():
+        merged = templated_workload.get(template)
+        if merged is None:
+            templated_workload[template] = template_timestamps
+            continue
+        for time_stamp, count in template_timestamps.items():
+            merged[time_stamp] = merged.get(time_stamp, 0) + count
+
+def ProcessDataParallel(path, output_dir, config, pool, jobs, chunk_size,
+        output_format="csv"):
+    # ProcessData for a single large file, read whole
+    templated_workload, processed_queries = TemplatizeDataParallel(path, config, pool, jobs,
+            chunk_size)
+
+    WriteWorkload(templated_workload, path, output_dir, output_format)
+
+    return processed_queries, TEMPLATES.Subset(templated_workload)
+
+def TemplatizeDataParallel(path, config, pool, jobs, chunk_size):
+    # This process only decompresses the file and hands out blocks of whole
+    # csv records to the pool, which parses them. A gzip stream can only be
+    # read front to back, so the workers can't read their own part of it.
+    # The partial workloads are merged in the order of the blocks.
+    print("Start processing: " + path)
 
-    INT_REGEX = r'([^a-zA-Z])-?\d+(\.\d+)?' # To prevent us from capturing table name like "a1"
+    templated_workload = dict()
+    processed_queries = 0
+    error = None
+    hits = 0
+    misses = 0
+    pending = collections.deque()
+
+    def Merge(result):
+        nonlocal processed_queries, error, hits, misses
+        (partial_workload, partial_templates, partial_queries, partial_error, partial_hits,
+                partial_misses) = result
+        TEMPLATES.Update(partial_templates)
+        hits += partial_hits
+        misses += partial_misses
+        # The serial path stops at the first error, so drop what comes after it
+        if error is not None:
+            return
+        MergeWorkload(templated_workload, partial_workload)
+        processed_queries += partial_queries
+        error = partial_error
+
+    read_error = None
+    try:
+        for block, read_error in ReadBlocks(path, chunk_size):
+            pending.append(pool.apply_async(ProcessChunk, ((block, config),)))
+            # Bound the number of chunks held in memory
+            while len(pending) >= 2 * jobs:
+                Merge(pending.popleft().get())
+    except Exception as e:
+        read_error = e
+    while pending:
+        Merge(pending.popleft().get())
+    if error is None and read_error is not None:
+        error = str(read_error)
 
-    HASH_REGEX = r'(\'\d+\\.*?\')'
+    if error is not None:
+        print("It might be an incomplete file. But we continue anyway.")
+        print(error)
+
+    lookups = hits + misses
+    print("Template cache for %s: %d hits, %d misses (%.1f%% hit rate)" % (path, hits, misses,
+        100.0 * hits / lookups if lookups else 0.0))
+
+    return templated_workload, processed_queries
+
+def RegexTemplate(query):
+    template = HASH_REGEX.sub(r"@@@", query)
+    template = STRING_REGEX.sub(r"\1&&&", template)
+    template = DOUBLE_QUOTE_STRING_REGEX.sub(r"\1&&&", template)
+    template = INT_REGEX.sub(r"\1#", template)
+    return template
+
+class UnsafeLiteral(Exception):
+    pass
+
+def ReplaceLiteral(m):
+    if m.group(4) is not None:
+        return m.group(4) + "#"
+    if m.group(2) is not None and "'" in m.group(2):
+        raise UnsafeLiteral()
+    if m.group(1) is not None or m.group(3) is not None:
+        return "&&&#"
+    if m.string[m.end():m.end() + 1] in ("'", '"'):
+        raise UnsafeLiteral()
+    return "&&&"
+
+def FastTemplate(query):
+    # Returns the template of RegexTemplate in a single pass, or None if the
+    # query has something where the passes interact: backslashes outside
+    # the hashed literals, newlines, a quote opening the query or following
+    # a string right away, or a single quote in a double quoted string.
+    if "\\" in query:
+        # The anonymizer writes its hashes as '<length>\<hash>'
+        query = HASH_REGEX.sub(r"@@@", query)
+        if "\\" in query:
+            return None
+    if "\n" in query or query[:1] in ("'", '"'):
+        return None
 
-    template = re.sub(HASH_REGEX, r"@@@", query)
-    template = re.sub(STRING_REGEX, r"\1&&&", template)
-    template = re.sub(DOUBLE_QUOTE_STRING_REGEX, r"\1&&&", template)
-    template = re.sub(INT_REGEX, r"\1#", template)
+    try:
+        return LITERAL_REGEX.sub(ReplaceLiteral, query)
+    except UnsafeLiteral:
+        return None
+
+def ExtractTemplate(query):
+    template = FastTemplate(query)
+    if template is None:
+        template = RegexTemplate(query)
+    return template
+
+class TemplateCache(object):
+    # A bounded LRU cache from the raw query text to its template ID, since
+    # the traces repeat the same queries verbatim over and over. With
+    # normalize, the templates are also normalized like the combiner does.
+
+    def __init__(self, max_size, normalize=False):
+        self.max_size = max_size
+        self.normalize = normalize
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, query):
+        template_id = self.entries.get(query)
+        if template_id is not None:
+            self.hits += 1
+            self.entries.move_to_end(query)
+            return template_id
+
+        self.misses += 1
+        template = ExtractTemplate(query)
+        if self.normalize:
+            template = NormalizeTemplate(template)
+        template_id = TEMPLATES.Add(template)
+        entry_size = len(query)
+        # Don't let a single huge query flush the whole cache
+        if entry_size * TEMPLATE_CACHE_MAX_ENTRY_FRACTION >= self.max_size:
+            return template_id
+
+        self.entries[query] = template_id
+        self.size += entry_size
+        while self.size > self.max_size:
+            old_query, old_template_id = self.entries.popitem(last=False)
+            self.size -= len(old_query)
+        return template_id
+
+    def ResetCounters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def HitRate(self):
+        lookups = self.hits + self.misses
+        return 100.0 * self.hits / lookups if lookups else 0.0
+
+# The text of the templates seen by this process, which the workloads are
+# keyed by the IDs of
+TEMPLATES = TemplateRegistry()
+
+TEMPLATE_CACHE = TemplateCache(TEMPLATE_CACHE_SIZE)
+
+def SetTemplateCache(max_size, normalize=False):
+    global TEMPLATE_CACHE
+    TEMPLATE_CACHE = TemplateCache(max_size, normalize)
+
+def MarkNormalized(output_dir):
+    # Tells the combiner whether the templates of the output directory are
+    # normalized already
+    path = os.path.join(output_dir, NORMALIZED_FILE)
+    if TEMPLATE_CACHE.normalize:
+        open(path, 'w').close()
+    elif os.path.exists(path):
+        os.remove(path)
 
-    if template in templated_workload:
+def GetTemplate(query, time_stamp, templated_workload):
+    # CHANGE: Returns a dictionary, where keys are template IDs, and they map
+    # to a map of timestamps map to query counts with that timestamp
+    #print("enter GetTemplate")
+    template_id = TEMPLATE_CACHE.Get(query)
+
+    if template_id in templated_workload:
         #print("enter GetTemplate if statement")
         # add timestamp
-        if time_stamp in templated_workload[template]:
-            templated_workload[template][time_stamp] += 1
+        if time_stamp in templated_workload[template_id]:
+            templated_workload[template_id][time_stamp] += 1
             #print("add to templated workload")
         else:
-            templated_workload[template][time_stamp] = 1
+            templated_workload[template_id][time_stamp] = 1
     else:
-        templated_workload[template] = dict()
-        templated_workload[template][time_stamp] = 1
+        templated_workload[template_id] = dict()
+        templated_workload[template_id][time_stamp] = 1
 
     return templated_workload
 
@@ -174,10 +569,10 @@ def MakeCSVFiles(workload_dict, min_timestamp, max_timestamp, output_dir):
         os.remove(output_dir + old_file)
 
     template_count = 0
-    for template in workload_dict:
+    for template_id in workload_dict:
         #print(template)
         template_timestamps = workload_dict[
-            template]  # time stamps for ith cluster
+            template_id]  # time stamps for ith cluster
         #time_stamp_dict = collections.OrderedDict()
         num_queries_for_template = sum(template_timestamps.values())
 
@@ -192,11 +587,11 @@ def MakeCSVFiles(workload_dict, min_timestamp, max_timestamp, output_dir):
 
         #    time_stamp_dict[time_stamp] = count
 
-        # write to csv file
-        with open(output_dir + 'template' + str(template_count) +
+        # write to csv file, named by the stable ID of the template
+        with open(output_dir + 'template' + str(template_id) +
                   ".csv", 'w') as csvfile:
             template_writer = csv.writer(csvfile, dialect='excel')
-            template_writer.writerow([num_queries_for_template, template])
+            template_writer.writerow([num_queries_for_template, TEMPLATES.Template(template_id)])
             for entry in sorted(template_timestamps.keys()):
                 template_writer.writerow([entry, template_timestamps[entry]])
             #for entry in time_stamp_dict:
@@ -206,7 +601,8 @@ def MakeCSVFiles(workload_dict, min_timestamp, max_timestamp, output_dir):
     
     print("Template count: " + str(template_count))
 
-def ProcessAnonymizedLogs(input_dir, output_dir, max_log, config):
+def ProcessAnonymizedLogs(input_dir, output_dir, max_log, config, jobs=1, split_size=None,
+        chunk_size=CHUNK_SIZE, output_format="csv", incremental=False):
     #print("Enter ProcessAnonymizedLogs")
     #print(f"Input directory: {input_dir}")
     #print(f"File pattern: {config['files']}")
@@ -225,22 +621,260 @@ def ProcessAnonymizedLogs(input_dir, output_dir, max_log, config):
         print("No files found matching the pattern - exiting")
         return
 
-    #print("finished joining")
-    proc = []
-    for i, log_file in enumerate(files):
-        #if i < 45:
-        #    continue
-        print(i, log_file)
+    # The templates found are added to the registry of the output directory
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    registry = TemplateRegistry(os.path.join(output_dir, REGISTRY_FILE))
+    MarkNormalized(output_dir)
+
+    manifest = None
+    settings = {'max_log': max_log, 'output_format': output_format,
+            'normalize': TEMPLATE_CACHE.normalize}
+    if incremental:
+        # Only the files not processed yet, or changed since
+        manifest = FileManifest(os.path.join(output_dir, MANIFEST_FILE))
+        num_files = len(files)
+        files = [log_file for log_file in files if not manifest.IsDone(log_file, **settings)]
+        print("%d of %d files already processed, %d templates registered" % (
+            num_files - len(files), num_files, len(registry)))
+        if not files:
+            print("No new files - exiting")
+            return
+
+    # Start with the largest files so that a big one doesn't run alone at
+    # the end
+    files.sort(key=os.path.getsize, reverse=True)
+    tasks = [(log_file, output_dir, max_log, config, output_format) for log_file in files]
+
+    # Files of at least split_size bytes are split between all the jobs, one
+    # after another. They are the largest, so they come first. Only whole
+    # files are split, as the records are not counted when they are cut.
+    num_split = 0
+    if split_size is not None and max_log is None:
+        num_split = sum(1 for log_file in files if os.path.getsize(log_file) >= split_size)
+
+    # Every worker holds the templated_workload of one file at a time, so
+    # the number of jobs caps the memory as well as the CPUs used
+    if num_split == 0:
+        jobs = min(jobs, len(files))
+    print("Processing %d files with %d jobs, %d of them split into chunks" % (len(files), jobs,
+        num_split))
+
+    def Record(i, log_file, num_queries, templates, elapsed):
+        registry.Update(templates)
+        registry.Save()
+        # A file only goes to the manifest once its output is complete
+        if manifest is not None:
+            manifest.Add(log_file, queries=num_queries, templates=len(templates), **settings)
+        print("[%d/%d] %s: %d queries, %d templates in %.1fs (%.0fs total)" % (i + 1,
+            len(tasks), log_file, num_queries, len(templates), elapsed, time.time() - start))
+
+    start = time.time()
+    with Pool(jobs, initializer=SetTemplateCache,
+            initargs=(TEMPLATE_CACHE.max_size, TEMPLATE_CACHE.normalize)) as pool:
+        for i, log_file in enumerate(files[:num_split]):
+            file_start = time.time()
+            num_queries, templates = ProcessDataParallel(log_file, output_dir, config, pool,
+                    jobs, chunk_size, output_format)
+            Record(i, log_file, num_queries, templates, time.time() - file_start)
+
+        for i, result in enumerate(pool.imap_unordered(ProcessFile, tasks[num_split:])):
+            log_file, num_queries, templates, elapsed = result
+            Record(num_split + i, log_file, num_queries, templates, elapsed)
+
+def FollowLines(path, on_idle, poll_interval=FOLLOW_POLL_INTERVAL):
+    # Yields the lines of a growing log like tail -F, reopening it when it is
+    # rotated or truncated. Standard input ("-") and named pipes end when
+    # their writer closes them. on_idle is called with the seconds since the
+    # last line whenever there is nothing to read.
+    f = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    growing = path != '-' and stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+    partial = b''
+    last_line = time.time()
+    try:
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                # Wait for the writer to finish the line
+                if not partial.endswith(b'\n'):
+                    continue
+                yield partial.decode('utf-8', errors='replace')
+                partial = b''
+                last_line = time.time()
+                continue
+
+            if not growing:
+                break
+            on_idle(time.time() - last_line)
+            time.sleep(poll_interval)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                # Rotated away, and not created again yet
+                continue
+            if current.st_ino != os.fstat(f.fileno()).st_ino or current.st_size < f.tell():
+                print("Reopening " + path)
+                f.close()
+                f = open(path, 'rb')
+                partial = b''
+        if partial:
+            yield partial.decode('utf-8', errors='replace')
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+def ReadLastRow(f, parse_minute):
+    # The offset, the minute and the count of the last row of a template csv
+    # file, or None if it can't be read
+    size = f.seek(0, os.SEEK_END)
+    start = max(0, size - 4096)
+    f.seek(start)
+    data = f.read().rstrip(b"\r\n")
+    idx = data.rfind(b"\n")
+    if idx < 0:
+        return None
+    try:
+        time_stamp, count = data[idx + 1:].decode('utf-8').split(',')
+        return start + idx + 1, parse_minute(time_stamp), int(count)
+    except ValueError:
+        return None
+
+def WriteCSVRows(template_id, rows, path):
+    with open(path, 'w') as csvfile:
+        template_writer = csv.writer(csvfile, dialect='excel')
+        template_writer.writerow(["%0*d" % (HEADER_COUNT_WIDTH,
+            sum(count for entry, count in rows)), TEMPLATES.Template(template_id)])
+        template_writer.writerows(rows)
+
+def UpdateCSVRows(template_id, rows, output_dir):
+    # Adds sorted (time stamp, count) rows to the csv file of a template, so
+    # that it keeps one row per minute in order after the query count. Rows
+    # that come after the file are appended and the padded count updated in
+    # place. A minute that was written already is added to its row, and the
+    # whole file is written again if that isn't the last one.
+    path = output_dir + 'template' + str(template_id) + ".csv"
+    if not os.path.exists(path):
+        WriteCSVRows(template_id, rows, path)
+        return
+
+    parse_minute = GetMinuteParser(DATETIME_FORMAT).Parse
+    with open(path, 'r+b') as f:
+        header = f.read(HEADER_COUNT_WIDTH + 1)
+        last_row = ReadLastRow(f, parse_minute)
+        if (header[:HEADER_COUNT_WIDTH].isdigit() and header[HEADER_COUNT_WIDTH:] == b',' and
+                last_row is not None and rows[0][0] >= last_row[1]):
+            offset, last_minute, last_count = last_row
+            num_queries = int(header[:HEADER_COUNT_WIDTH]) + sum(count for entry, count in rows)
+            if rows[0][0] == last_minute:
+                f.truncate(offset)
+                rows = [(last_minute, last_count + rows[0][1])] + rows[1:]
+            f.seek(0)
+            f.write(b"%0*d" % (HEADER_COUNT_WIDTH, num_queries))
+            f.seek(0, os.SEEK_END)
+            f.write("".join("%s,%d\r\n" % (entry, count) for entry, count in rows).encode(
+                'utf-8'))
+            return
+
+    # Merge the late rows into the whole series
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        template_timestamps = {parse_minute(line[0]): int(line[1]) for line in reader}
+    for entry, count in rows:
+        template_timestamps[entry] = template_timestamps.get(entry, 0) + count
+    WriteCSVRows(template_id, sorted(template_timestamps.items()), path)
+
+def FlushMinutes(templated_workload, before, output_dir, registry):
+    # Adds the counts of the minutes earlier than before, or of all of
+    # them if before is None, to the csv files and drops them from the
+    # workload. Returns the number of queries written.
+    flushed = 0
+    for template_id in list(templated_workload):
+        template_timestamps = templated_workload[template_id]
+        closed = sorted(entry for entry in template_timestamps
+                if before is None or entry < before)
+        if not closed:
+            continue
+        rows = [(entry, template_timestamps.pop(entry)) for entry in closed]
+        if template_id not in registry:
+            registry.Add(TEMPLATES.Template(template_id), template_id)
+        UpdateCSVRows(template_id, rows, output_dir)
+        flushed += sum(count for entry, count in rows)
+        if not template_timestamps:
+            del templated_workload[template_id]
+    registry.Save()
+    return flushed
+
+def FollowLog(path, output_dir, config):
+    # Templatizes the queries of a live log as they are written. The counts
+    # of a minute are appended to the templateN.csv files as soon as a query
+    # of a later minute comes in, or the log is idle for FOLLOW_IDLE_FLUSH,
+    # so only the open minute is kept in memory. Queries of a minute already
+    # written are added to its row.
+    name = 'stdin' if path == '-' else path
+    template_dir = TemplateDir(name, output_dir)
+    if not os.path.exists(template_dir):
+        os.makedirs(template_dir)
+    registry = TemplateRegistry(os.path.join(output_dir, REGISTRY_FILE))
+    MarkNormalized(output_dir)
+
+    print("Following " + name)
+    print(template_dir)
 
-        #continue
+    templated_workload = dict()
+    row_query = CompileRowParser(config)
+    open_minute = None
+    processed_queries = 0
+    errors = 0
 
-        # Process log
-        p = Process(target = ProcessData, args = (log_file, output_dir, max_log, config))
-        p.start()
-        proc.append(p)
+    def Flush(before):
+        flushed = FlushMinutes(templated_workload, before, template_dir, registry)
+        if flushed > 0:
+            print("%s: %d queries written, %d rows read, %d templates" % (open_minute,
+                flushed, processed_queries, len(registry)))
 
-    for p in proc:
-        p.join()
+    def OnIdle(idle):
+        if templated_workload and idle >= FOLLOW_IDLE_FLUSH:
+            Flush(None)
+
+    reader = csv.reader(FollowLines(path, OnIdle), delimiter=',')
+    try:
+        while True:
+            # The reader carries on with the next line after a malformed one
+            try:
+                query_info = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                processed_queries += 1
+                errors += 1
+                print("Skipping row %d: %s" % (processed_queries, e))
+                continue
+            processed_queries += 1
+            try:
+                row = row_query(query_info)
+            except Exception as e:
+                # A live log can't be skipped as an incomplete file
+                errors += 1
+                print("Skipping row %d: %s" % (processed_queries, e))
+                continue
+            if row is None:
+                continue
+
+            time_stamp, query = row
+            if open_minute is None or time_stamp > open_minute:
+                # The minutes before this one are closed
+                Flush(time_stamp)
+                open_minute = time_stamp
+            GetTemplate(query, time_stamp, templated_workload)
+    except KeyboardInterrupt:
+        print("Interrupted")
+
+    # Whatever is left, so that stopping the follow doesn't lose it
+    Flush(None)
+    print("End of %s: %d rows, %d skipped, %d templates" % (name, processed_queries, errors,
+        len(registry)))
 
 
 # ==============================================
@@ -253,27 +887,49 @@ if __name__ == '__main__':
     aparser.add_argument('--output', help='Output data directory')
     aparser.add_argument('--max_log', type=int, help='Maximum number of logs to process in a'
             'data file. Process the whole file if not provided')
+    aparser.add_argument('--cache_mb', type=int, default=TEMPLATE_CACHE_SIZE // (1024 * 1024),
+            help='Memory budget of the raw query to template cache of every job, 0 disables '
+            'it')
+    aparser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of files '
+            'processed at the same time')
+    aparser.add_argument('--split_mb', type=int, help='Split the files of at least this size '
+            'into chunks templatized by all the jobs. Every file is processed by a single job '
+            'if not provided, or with --max_log')
+    aparser.add_argument('--chunk_mb', type=float, default=CHUNK_SIZE / (1024 * 1024),
+            help='Size of a chunk of a split file, decompressed')
+    aparser.add_argument('--output_format', default="csv", choices=OUTPUT_FORMATS,
+            help='Write the templates of every file to templateN.csv files, or to a single '
+            'compressed columnar .npz template store')
+    aparser.add_argument('--incremental', action='store_true', help='Only templatize the files '
+            'not processed into the output directory yet')
+    aparser.add_argument('--normalize', action='store_true', help='Normalize the templates '
+            'as the combiner does, which then keeps them as they are')
+    aparser.add_argument('--follow', metavar='LOG', help='Templatize a live log file as it '
+            'grows, or standard input with -, and append the counts of every minute to the '
+            'csv files once it is over')
     args = vars(aparser.parse_args())
 
-    #initial test - hardcode: later see docker arguments command
-    input_dir = "/app"
-    output_dir = "/app/output"
-    max_log = 1000
-    config = {
-        "name": "tiramisu",
-        "files": "dbp*postgresql-*.zip.anonymized.gz.anonymized.sample.gz",
-        "mysql": False,
-        "query_index": 3,
-        "time_stamp_format": "%Y-%m-%d %H:%M:%S"
-    }
+    if args['follow'] is not None and args['output_format'] != "csv":
+        aparser.error("--follow only appends to templateN.csv files")
+    if args['output'] is None:
+        aparser.error("--output is required")
+    if args['follow'] is None and args['dir'] is None:
+        aparser.error("--dir is required")
 
-    ProcessAnonymizedLogs(input_dir, output_dir, max_log, config)
+    split_size = None
+    if args['split_mb'] is not None:
+        split_size = args['split_mb'] * 1024 * 1024
 
-    #Container testing/debugging
-    #while True:
-    #    time.sleep(1)
+    SetTemplateCache(args['cache_mb'] * 1024 * 1024, args['normalize'])
 
+    config = PROJECTS[args['project']]
+    # Fail before reading anything if the project has no parser
+    CompileRowParser(config)
 
-    #ProcessAnonymizedLogs(args['dir'], args['output'], args['max_log'], PROJECTS[args['project']])
-    
+    if args['follow'] is not None:
+        FollowLog(args['follow'], args['output'], config)
+        sys.exit(0)
 
+    ProcessAnonymizedLogs(args['dir'], args['output'], args['max_log'], config, args['jobs'],
+            split_size, int(args['chunk_mb'] * 1024 * 1024), args['output_format'],
+            args['incremental'])